@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+'''
+    Benchmarks for totoro scripts
+
+    Each benchmark generates its own synthetic data in a
+    temporary directory and prints timings to stdout
+
+    run example:
+    ./benchmark.py --b fused --n 20000 --length 5000
+'''
+
+import sys, os, argparse, random, subprocess, tempfile, time
+from collections import defaultdict
+from itertools import islice
+
+import nucleotides, seqparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def GetOptParser():
+
+    optionParser = argparse.ArgumentParser()
+
+    optionParser.add_argument('--b', '--bench',
+        action='append',
+        help="Benchmark to run, can be repeated [default: all]\n\
+        * 'fused' fasta-kit.py multi-action pipeline against a shell pipe *\n\
+        * 'revcom' reverse-complement and case transforms, bases per second *\n\
+        * 'parser' seqparse FASTA/FASTQ readers against former per-script readers, records per second *\n\
+        * 'startup' plotting scripts: --help and --table-only against former top-level imports *\n\
+        * 'kmers' k-mer counting against per-position dict increments, bases per second *\n\
+        * 'codons' plot_CU.py codon counting against per-codon dict increments, codons per second *")
+
+    optionParser.add_argument('--n', '--entries',
+        type=int, default=10000,
+        help="Number of synthetic fasta entries [default: 10000]")
+
+    optionParser.add_argument('--length',
+        type=int, default=2000,
+        help="Mean length of synthetic entries [default: 2000]")
+
+    optionParser.add_argument('--seed',
+        type=int, default=1,
+        help="Random seed for synthetic data")
+
+    return optionParser
+
+'''
+    Synthetic data and timing helpers
+'''
+
+def WriteRandomFastq(path, reads, read_length=150):
+
+    with open(path, 'w') as fastq_file:
+        for i in range(reads):
+            seq = ''.join(random.choices('ACGTN', weights=[10, 10, 10, 10, 1], k=read_length))
+            qual = ''.join(random.choices('#+5?FIJ', k=read_length))
+            fastq_file.write('@read{} 1:N:0:1\n{}\n+\n{}\n'.format(i, seq, qual))
+
+def WriteRandomFasta(path, entries, mean_length, line_width=60):
+
+    with open(path, 'w') as fasta_file:
+        for i in range(entries):
+            length = random.randint(mean_length // 2, mean_length * 3 // 2)
+            seq = ''.join(random.choices('ACGTacgtN', weights=[10, 10, 10, 10, 2, 2, 2, 2, 1], k=length))
+            fasta_file.write('>seq{} synthetic entry\n'.format(i))
+            for p in range(0, length, line_width):
+                fasta_file.write(seq[p:p+line_width] + '\n')
+
+def TimeCommand(command, repeats=3):
+
+    best = None
+    for r in range(repeats):
+        started = time.perf_counter()
+        subprocess.run(command, shell=True, check=True)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+def TimeCall(func, *args, repeats=3):
+
+    best = None
+    for r in range(repeats):
+        started = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+def ReportRate(name, seconds, amount, unit):
+
+    print('{:<40}{:>14,.0f} {}/s'.format(name, amount / seconds, unit))
+
+def Report(name, seconds, baseline=None):
+
+    if baseline is None:
+        print('{:<40}{:>10.3f} s'.format(name, seconds))
+    else:
+        print('{:<40}{:>10.3f} s{:>10.2f}x'.format(name, seconds, baseline / seconds))
+
+'''
+    Benchmarks
+'''
+
+def BenchFused(workdir, runArgs):
+
+    fasta = os.path.join(workdir, 'fused.fa')
+    keep_list = os.path.join(workdir, 'fused.list')
+    WriteRandomFasta(fasta, runArgs.n, runArgs.length)
+    with open(keep_list, 'w') as list_file:
+        for i in range(0, runArgs.n, 2):
+            list_file.write('seq{} synthetic entry\n'.format(i))
+
+    kit = '{} {}'.format(sys.executable, os.path.join(SCRIPT_DIR, 'fasta-kit.py'))
+    piped = '{kit} --i {fa} --a keep --l {lst} | {kit} --a upper | {kit} --a prename | {kit} --a revcom > {out}'.format(
+        kit=kit, fa=fasta, lst=keep_list, out=os.path.join(workdir, 'piped.out'))
+    fused = '{kit} --i {fa} --a keep --l {lst} --a upper --a prename --a revcom > {out}'.format(
+        kit=kit, fa=fasta, lst=keep_list, out=os.path.join(workdir, 'fused.out'))
+
+    print('fasta-kit.py keep+upper+prename+revcom, {} entries'.format(runArgs.n))
+    piped_time = TimeCommand(piped)
+    Report('shell pipe of 4 invocations', piped_time)
+    Report('fused single invocation', TimeCommand(fused), piped_time)
+
+def LegacyRevcomDNA(dna):
+    '''
+        Per-base dict lookup and string append,
+        as fasta-kit.py did before table translation
+    '''
+    revNucDict = defaultdict(lambda: 'N')
+    revNucDict.update(zip('ACGTacgt', 'TGCAtgca'))
+    revcom = ''
+    for n in dna[::-1]:
+        revcom += revNucDict[n]
+    return revcom
+
+def BenchRevcom(workdir, runArgs):
+
+    length = runArgs.n * runArgs.length
+    seq = ''.join(random.choices('ACGTacgtN', weights=[10, 10, 10, 10, 2, 2, 2, 2, 1], k=length))
+    legacy_seq = seq[:min(length, 2000000)]
+
+    print('Sequence transforms, {:,} bases'.format(length))
+    ReportRate('legacy revcom (dict lookups)', TimeCall(LegacyRevcomDNA, legacy_seq, repeats=1), len(legacy_seq), 'bases')
+    ReportRate('revcom', TimeCall(nucleotides.RevcomDNA, seq), length, 'bases')
+    ReportRate('revcom --iupac', TimeCall(nucleotides.RevcomDNA, seq, True), length, 'bases')
+    ReportRate('upper', TimeCall(seq.upper), length, 'bases')
+    ReportRate('lower', TimeCall(seq.lower), length, 'bases')
+
+def LegacyReadFasta(fasta_path):
+    '''
+        Text lines, rstrip and join, as ReadFasta of fasta-kit.py,
+        get-locus.py and twobit.py did before seqparse
+    '''
+    entry_name  = None
+    entry_lines = []
+    with open(fasta_path, 'r') as input_lines:
+        for line in input_lines:
+            line = line.rstrip()
+            if len(line) < 1:
+                continue
+            if line[0] == '>':
+                if entry_name is not None:
+                    yield entry_name, ''.join(entry_lines)
+                entry_name  = line[1:]
+                entry_lines = []
+            else:
+                entry_lines.append(line)
+
+    if entry_name is not None:
+        yield entry_name, ''.join(entry_lines)
+
+def LegacyKmerFasta(fasta_path):
+    '''
+        Per-line loop of make_kmer_PCA.py, without k-mer counting
+    '''
+    labelItem = None
+    with open(fasta_path, 'r') as data_input_file:
+        for line in data_input_file:
+            if line[0] == '>':
+                if labelItem is not None:
+                    yield labelItem
+                labelItem = line[1:].rstrip()
+            else:
+                line.lstrip().rstrip()
+
+    if labelItem is not None:
+        yield labelItem
+
+def LegacyConcatFasta(fasta_path):
+    '''
+        String concatenation of plot_CU.py
+    '''
+    cdsEntries = []
+    with open(fasta_path, 'r') as inputCdsFile:
+        for line in inputCdsFile:
+            if line[0] == '>':
+                cdsEntries.append('')
+            else:
+                cdsEntries[-1] += line.rstrip().upper()
+
+    return cdsEntries
+
+def LegacyReadFastq(fastq_path):
+    '''
+        islice by 4 lines of filter-mapped-fastq.py
+    '''
+    with open(fastq_path, 'r') as infile:
+        while True:
+            read_data = list(islice(infile, 4))
+            if not read_data:
+                break
+            yield read_data
+
+def ParseFasta(fasta_path, decode=False):
+
+    with open(fasta_path, 'rb') as fasta_handle:
+        for title, seq in seqparse.ReadFasta(fasta_handle):
+            if decode:
+                title.decode(), seq.decode()
+            yield title
+
+def ParseFastq(fastq_path):
+
+    with open(fastq_path, 'rb') as fastq_handle:
+        for record in seqparse.ReadFastq(fastq_handle):
+            yield record
+
+def ParseFastqBlocks(fastq_path):
+
+    with open(fastq_path, 'rb') as fastq_handle:
+        for data, starts, header_ends in seqparse.ReadFastqBlocks(fastq_handle):
+            yield from header_ends
+
+def Consume(reader, *args):
+
+    count = 0
+    for item in reader(*args):
+        count += 1
+
+    return count
+
+def BenchParser(workdir, runArgs):
+
+    fasta = os.path.join(workdir, 'parser.fa')
+    fastq = os.path.join(workdir, 'parser.fq')
+    WriteRandomFasta(fasta, runArgs.n, runArgs.length)
+    WriteRandomFastq(fastq, runArgs.n * 10)
+
+    print('FASTA readers, {} entries'.format(runArgs.n))
+    for name, reader, args in [
+        ('former ReadFasta (fasta-kit, get-locus)', LegacyReadFasta, (fasta, )),
+        ('former make_kmer_PCA line loop', LegacyKmerFasta, (fasta, )),
+        ('former plot_CU concatenation', LegacyConcatFasta, (fasta, )),
+        ('seqparse.ReadFasta', ParseFasta, (fasta, )),
+        ('seqparse.ReadFasta + decode', ParseFasta, (fasta, True))]:
+        ReportRate(name, TimeCall(Consume, reader, *args), runArgs.n, 'records')
+
+    print('FASTQ readers, {} reads'.format(runArgs.n * 10))
+    ReportRate('former islice reader (filter-mapped)', TimeCall(Consume, LegacyReadFastq, fastq), runArgs.n * 10, 'records')
+    ReportRate('seqparse.ReadFastq', TimeCall(Consume, ParseFastq, fastq), runArgs.n * 10, 'records')
+    ReportRate('seqparse.ReadFastqBlocks', TimeCall(Consume, ParseFastqBlocks, fastq), runArgs.n * 10, 'records')
+
+def LegacyCountKmers(seq, kmerl):
+    '''
+        Per-position slicing and dict increments,
+        as make_kmer_PCA.py did before kmers.py
+    '''
+    countItem = defaultdict(lambda : 0.0)
+    for pos in range(0, len(seq)-kmerl+1):
+        countItem[seq[pos:pos+kmerl]] += 1
+
+    return countItem
+
+def BenchKmers(workdir, runArgs):
+
+    import kmers
+
+    length = runArgs.n * runArgs.length
+    seq = ''.join(random.choices('ACGTacgtN', weights=[10, 10, 10, 10, 2, 2, 2, 2, 1], k=length))
+    legacy_seq = seq[:min(length, 2000000)]
+
+    print('K-mer counting, {:,} bases'.format(length))
+    for k in (3, 8, 12):
+        ReportRate('legacy dict increments, k={}'.format(k), TimeCall(LegacyCountKmers, legacy_seq, k, repeats=1), len(legacy_seq), 'bases')
+        ReportRate('kmers.CountKmers, k={}'.format(k), TimeCall(kmers.CountKmers, seq.encode(), k), length, 'bases')
+
+def LegacyCountCodons(cds_path):
+    '''
+        List of all CDS and per-codon slicing into a dict,
+        as plot_CU.py did before kmers.CountCodons
+    '''
+    cu = defaultdict(lambda : 0.0)
+    with open(cds_path, 'rb') as cds_file:
+        cdsEntries = [seq.upper().decode() for title, seq in seqparse.ReadFasta(cds_file)]
+    for cds in cdsEntries:
+        if len(cds) % 3 == 0:
+            for p in range(0, len(cds), 3):
+                cu[cds[p:p+3]] += 1
+
+    return cu
+
+def BenchCodons(workdir, runArgs):
+
+    cds = os.path.join(workdir, 'codons.fa')
+    with open(cds, 'w') as cds_file:
+        for i in range(runArgs.n):
+            seq = ''.join(random.choices('ACGTN', weights=[10, 10, 10, 10, 1], k=random.randint(100, 700) * 3))
+            cds_file.write('>cds{}\n{}\n'.format(i, seq))
+    codon_count = os.path.getsize(cds) // 3
+
+    sys.path.insert(0, SCRIPT_DIR)
+    import importlib
+    plot_CU = importlib.import_module('plot_CU')
+    codons = [i + j + k for i in 'AGTC' for j in 'AGTC' for k in 'AGTC']
+
+    print('Codon counting, {} CDS'.format(runArgs.n))
+    ReportRate('former list + dict increments', TimeCall(LegacyCountCodons, cds), codon_count, 'codons')
+    ReportRate('plot_CU.CountCodonUsage', TimeCall(plot_CU.CountCodonUsage, cds, codons), codon_count, 'codons')
+
+# what make_kmer_PCA.py, plot_CU.py and plot-hist.py imported
+# at module top before any argument was parsed
+LEGACY_IMPORTS = "import matplotlib; matplotlib.use('Agg'); import matplotlib.pyplot, pandas, seaborn, numpy; \
+from mpl_toolkits.mplot3d import Axes3D; from sklearn.preprocessing import StandardScaler; from sklearn.decomposition import PCA"
+
+def BenchStartup(workdir, runArgs):
+
+    entries = min(runArgs.n, 200)
+    fasta = os.path.join(workdir, 'startup.fa')
+    species_list = os.path.join(workdir, 'startup.species')
+    values = os.path.join(workdir, 'startup.values')
+    WriteRandomFasta(fasta, entries, 300)
+    with open(species_list, 'w') as list_file:
+        list_file.write('A\t{}\nB\t{}\nC\t{}\n'.format(fasta, fasta, fasta))
+    with open(values, 'w') as values_file:
+        for i in range(entries * 10):
+            values_file.write('{}\n'.format(random.gauss(10, 3)))
+
+    def Script(name):
+        return '{} {}'.format(sys.executable, os.path.join(SCRIPT_DIR, name))
+    out = os.path.join(workdir, 'startup')
+
+    print('Plotting scripts startup, {} entries'.format(entries))
+    legacy_time = TimeCommand('{} -c "{}"'.format(sys.executable, LEGACY_IMPORTS))
+    Report('former top-level imports', legacy_time)
+    for name, command in [
+        ('make_kmer_PCA.py --help', Script('make_kmer_PCA.py') + ' --help > /dev/null'),
+        ('make_kmer_PCA.py --table-only', '{} --f {} --o {} --table-only'.format(Script('make_kmer_PCA.py'), fasta, out)),
+        ('plot_CU.py --help', Script('plot_CU.py') + ' --help > /dev/null'),
+        ('plot_CU.py --table-only', '{} --sl {} --o {} --table-only > /dev/null'.format(Script('plot_CU.py'), species_list, out)),
+        ('plot-hist.py --help', Script('plot-hist.py') + ' --help > /dev/null'),
+        ('plot-hist.py --table-only', '{} --i {} --table-only > /dev/null'.format(Script('plot-hist.py'), values))]:
+        Report(name, TimeCommand(command), legacy_time)
+
+BENCHMARKS = {
+'fused' : BenchFused,
+'revcom' : BenchRevcom,
+'parser' : BenchParser,
+'startup' : BenchStartup,
+'kmers' : BenchKmers,
+'codons' : BenchCodons
+}
+
+if __name__ == '__main__':
+
+    runArgs = GetOptParser().parse_args(sys.argv[1:])
+    random.seed(runArgs.seed)
+
+    selected = runArgs.b
+    if selected is None:
+        selected = list(BENCHMARKS.keys())
+
+    for name in selected:
+        if name not in BENCHMARKS:
+            sys.stderr.write('Unknown benchmark {}!\nExiting with an error!'.format(name))
+            exit()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in selected:
+            BENCHMARKS[name](workdir, runArgs)
+            print('')
@@ -0,0 +1,87 @@
+'''
+    Codon usage statistics of per-gene codon count matrices
+
+    Rows are genes, columns are the 64 codons in the order given
+    by caller. All statistics are computed for every gene at once
+    with matrix products against 64 x amino acid indicator tables
+    of the standard genetic code.
+
+    RSCU: codon count over the mean count of its synonymous codons
+    (0 when the amino acid is absent from the gene).
+    ENC: effective number of codons of Wright (1990), from
+    homozygosity F of amino acids seen at least twice, averaged
+    per degeneracy class (2, 3, 4 and 6-fold; Ile missing F3 is
+    (F2 + F4) / 2), capped at 61, NaN when a class has no data.
+    GC3: G or C fraction at third positions of all codons.
+'''
+
+import numpy as np
+
+# standard genetic code, codons in TCAG order
+CODE_BASES = 'TCAG'
+CODE_AMINO_ACIDS = 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+STANDARD_CODE = dict((a + b + c, CODE_AMINO_ACIDS[i * 16 + j * 4 + k])
+    for i, a in enumerate(CODE_BASES) for j, b in enumerate(CODE_BASES) for k, c in enumerate(CODE_BASES))
+
+# Wright's degeneracy classes and number of amino acids in each
+ENC_CLASSES = ((2, 9), (3, 1), (4, 5), (6, 3))
+
+
+def Families(codons, code=STANDARD_CODE):
+    '''
+        Amino acids (stop is '*') and 64 x amino acid
+        indicator matrix of their codons
+    '''
+    amino_acids = sorted(set(code[codon] for codon in codons))
+    families = np.zeros((len(codons), len(amino_acids)))
+    for i, codon in enumerate(codons):
+        families[i, amino_acids.index(code[codon])] = 1.0
+
+    return amino_acids, families
+
+def RSCU(counts, codons):
+
+    amino_acids, families = Families(codons)
+    counts = np.asarray(counts, dtype=np.float64)
+    # mean count of synonymous codons, per codon column
+    family_mean = (counts @ families) / families.sum(axis=0)
+    codon_mean = family_mean @ families.T
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rscu = counts / codon_mean
+    rscu[codon_mean == 0] = 0.0
+
+    return rscu
+
+def ENC(counts, codons):
+
+    amino_acids, families = Families(codons)
+    counts = np.asarray(counts, dtype=np.float64)
+    degeneracy = families.sum(axis=0)
+    sense = np.array([aa != '*' for aa in amino_acids])
+
+    n = counts @ families
+    squares = (counts * counts) @ families
+    with np.errstate(invalid='ignore', divide='ignore'):
+        homozygosity = (squares / n - 1.0) / (n - 1.0)
+    # F of amino acids seen at least twice
+    seen = n > 1
+
+    average = {}
+    for fold, members in ENC_CLASSES:
+        in_class = seen & ((degeneracy == fold) & sense)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            average[fold] = np.where(in_class, homozygosity, 0.0).sum(axis=1) / in_class.sum(axis=1)
+    average[3] = np.where(np.isnan(average[3]), (average[2] + average[4]) / 2, average[3])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        enc = 2.0 + sum(members / average[fold] for fold, members in ENC_CLASSES)
+
+    return np.minimum(enc, 61.0)
+
+def GC3(counts, codons):
+
+    counts = np.asarray(counts, dtype=np.float64)
+    third_gc = np.array([codon[2] in 'GC' for codon in codons], dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (counts @ third_gc) / counts.sum(axis=1)
@@ -0,0 +1,135 @@
+'''
+    On-disk cache of per-file count profiles
+
+    Profiles (k-mer frequency rows of make_kmer_PCA.py, codon
+    counts of plot_CU.py) are stored as compressed .npz files
+    named by input content hash, counting mode and parser version,
+    so a renamed or copied file still hits and an edited one
+    misses. Content hashes are remembered by path, size and mtime,
+    an unchanged file is not read again.
+
+    Entries are touched on every hit; once the cache grows over
+    its size limit, least recently used entries are removed.
+'''
+
+import os, json, hashlib, tempfile
+import seqparse
+
+# default size limit, MB
+DEFAULT_LIMIT = 1024
+
+HASH_BLOCK = 2**20
+
+HASHES_FILE = 'hashes.json'
+
+
+def FileDigest(path):
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as input_file:
+        while True:
+            block = input_file.read(HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+
+    return digest.hexdigest()
+
+class ProfileCache(object):
+
+    def __init__(self, directory, limit=DEFAULT_LIMIT):
+
+        self.directory = directory
+        self.limit = limit * 2**20
+        os.makedirs(directory, exist_ok=True)
+
+        # real path -> [size, mtime_ns, digest]
+        self.hashes_path = os.path.join(directory, HASHES_FILE)
+        self.hashes = {}
+        self.hashes_changed = False
+        try:
+            with open(self.hashes_path) as hashes_file:
+                self.hashes = json.load(hashes_file)
+        except (IOError, ValueError):
+            pass
+
+    def Digest(self, path):
+        '''
+            Content hash of file, recomputed only when
+            its size or mtime changed
+        '''
+        real_path = os.path.realpath(path)
+        stat = os.stat(real_path)
+        known = self.hashes.get(real_path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+
+        digest = FileDigest(real_path)
+        self.hashes[real_path] = [stat.st_size, stat.st_mtime_ns, digest]
+        self.hashes_changed = True
+
+        return digest
+
+    def EntryPath(self, path, mode):
+        return os.path.join(self.directory, '{}-{}-p{}.npz'.format(self.Digest(path), mode, seqparse.PARSER_VERSION))
+
+    def Load(self, path, mode):
+        '''
+            Dict of arrays stored for file and mode, None on a miss
+        '''
+        import numpy as np
+
+        entry_path = self.EntryPath(path, mode)
+        try:
+            with np.load(entry_path) as entry:
+                arrays = dict(entry)
+        except (IOError, ValueError):
+            return None
+        os.utime(entry_path)
+
+        return arrays
+
+    def Store(self, path, mode, **arrays):
+        '''
+            Written to a temporary file first, so concurrent
+            runs never see a partial entry
+        '''
+        import numpy as np
+
+        entry_path = self.EntryPath(path, mode)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as temp_file:
+            np.savez_compressed(temp_file, **arrays)
+        os.replace(temp_path, entry_path)
+
+        self.Evict()
+
+    def Evict(self):
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in entries:
+            if total <= self.limit:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def Close(self):
+
+        if self.hashes_changed:
+            # drop files that are gone
+            self.hashes = dict((path, known) for path, known in self.hashes.items() if os.path.exists(path))
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(handle, 'w') as temp_file:
+                json.dump(self.hashes, temp_file)
+            os.replace(temp_path, self.hashes_path)
+            self.hashes_changed = False
@@ -0,0 +1,187 @@
+'''
+    samtools-compatible .fai index for .fasta files
+
+    Index line: name, length, offset, line bases, line width
+    (tab-separated), name is the entry title up to the first
+    whitespace. Regions are read by seeking straight to their
+    bytes, so a lookup costs a few KB of I/O.
+
+    For BGZF compressed files offsets are in uncompressed data,
+    as samtools does, and regions are read through .gzi index.
+
+    Coordinates in this module are 0-based, end-exclusive.
+'''
+
+import os
+from collections import defaultdict
+
+import seqopen
+
+
+class FastaIndex(list):
+    '''
+        List of index entries, with entries of every
+        name kept by name for constant-time lookups
+    '''
+    def __init__(self, entries=()):
+
+        super(FastaIndex, self).__init__(entries)
+        self.by_name = defaultdict(list)
+        for entry in self:
+            self.by_name[entry[0]].append(entry)
+
+def FaiPath(fasta_path):
+    return fasta_path + '.fai'
+
+def BuildIndex(fasta_handle):
+    '''
+        Scan binary fasta handle and return FastaIndex of
+        [name, length, offset, line_bases, line_width]
+        Raises ValueError on irregular line lengths
+    '''
+    index = []
+    entry = None
+    offset = 0
+    short_line = False
+
+    for line in fasta_handle:
+        line_width = len(line)
+        line_bases = len(line.rstrip(b'\r\n'))
+        if line.startswith(b'>'):
+            toks = line[1:].split(None, 1)
+            name = toks[0].decode() if toks else ''
+            entry = [name, 0, offset + line_width, 0, 0]
+            index.append(entry)
+            short_line = False
+        elif entry is None:
+            if line_bases > 0:
+                raise ValueError('Sequence data before first title line')
+        elif line_bases == 0:
+            short_line = True
+        else:
+            if short_line:
+                raise ValueError('Different line length in sequence \'{}\''.format(entry[0]))
+            line_end = line_width - line_bases
+            if entry[3] == 0:
+                entry[3] = line_bases
+                entry[4] = line_width
+            elif line_bases > entry[3] or (line_end > 0 and line_end != entry[4] - entry[3]):
+                raise ValueError('Different line length in sequence \'{}\''.format(entry[0]))
+            if line_bases < entry[3] or line_width == line_bases:
+                short_line = True
+            entry[1] += line_bases
+        offset += line_width
+
+    return FastaIndex(index)
+
+def WriteIndex(index, fai_path):
+
+    with open(fai_path, 'w') as fai_file:
+        for entry in index:
+            fai_file.write('\t'.join(str(v) for v in entry) + '\n')
+
+def ReadIndex(fai_path):
+
+    index = []
+    with open(fai_path, 'r') as fai_file:
+        for line in fai_file:
+            toks = line.rstrip('\r\n').split('\t')
+            if len(toks) < 5:
+                continue
+            index.append([toks[0]] + [int(v) for v in toks[1:5]])
+
+    return FastaIndex(index)
+
+def LoadIndex(fasta_path):
+    '''
+        Reuse up-to-date .fai next to fasta file or build a new one,
+        saving it when the directory is writable
+    '''
+    fai_path = FaiPath(fasta_path)
+    if os.path.isfile(fai_path) and os.path.getmtime(fai_path) >= os.path.getmtime(fasta_path):
+        return ReadIndex(fai_path)
+
+    with seqopen.OpenInput(fasta_path, 'rb') as fasta_handle:
+        index = BuildIndex(fasta_handle)
+
+    try:
+        WriteIndex(index, fai_path)
+    except IOError:
+        pass
+
+    return index
+
+def ReadTitle(fasta_handle, entry):
+    '''
+        Full title line (without '>') of indexed entry,
+        it is the line right before entry sequence offset
+    '''
+    end = entry[2]
+    window = 256
+    while True:
+        start = max(0, end - window)
+        fasta_handle.seek(start)
+        data = fasta_handle.read(end - start)
+        line_start = data.rfind(b'\n', 0, len(data) - 1)
+        if line_start >= 0 or start == 0:
+            title = data[line_start+1:].rstrip()
+            return title[1:].decode()
+        window *= 4
+
+def IndexName(entry_name):
+    '''
+        Name of entry in index: title up to first whitespace
+    '''
+    toks = entry_name.split(None, 1)
+
+    return toks[0] if toks else ''
+
+def FindEntry(index, fasta_handle, entry_name, split_space=False):
+    '''
+        Find indexed entry by full title or, with split_space,
+        by title prefix before first space. As with sequential
+        reading, the last of same-named entries wins.
+    '''
+    for entry in reversed(index.by_name.get(IndexName(entry_name), [])):
+        title = ReadTitle(fasta_handle, entry)
+        if split_space:
+            title = title.split(' ')[0]
+        if title == entry_name:
+            return entry
+
+    return None
+
+def FindEntries(index, fasta_handle, entry_names, split_space=False):
+    '''
+        FindEntry of many names, dict of found entries by name.
+        Names are looked up in file order of their entries, so
+        title reads go forward through the file
+    '''
+    def Offset(entry_name):
+        entries = index.by_name.get(IndexName(entry_name))
+        return entries[-1][2] if entries else -1
+
+    found = {}
+    for entry_name in sorted(entry_names, key=Offset):
+        entry = FindEntry(index, fasta_handle, entry_name, split_space)
+        if entry is not None:
+            found[entry_name] = entry
+
+    return found
+
+def FetchRegion(fasta_handle, entry, start, end):
+    '''
+        Sequence of indexed entry in [start, end) range
+    '''
+    name, length, offset, line_bases, line_width = entry
+    start = max(0, start)
+    end = min(end, length)
+    if end <= start:
+        return ''
+
+    first = offset + (start // line_bases) * line_width + start % line_bases
+    last  = offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases + 1
+    fasta_handle.seek(first)
+    data = fasta_handle.read(last - first)
+
+    return data.replace(b'\n', b'').replace(b'\r', b'').decode()
@@ -14,9 +14,12 @@
 '''
 
 
-import sys, random, os, argparse
+import sys, random, os, re, io, argparse, multiprocessing
 
 from collections import defaultdict
+from itertools import islice
+
+import motifs, nucleotides, seqopen, seqparse, twobit
 
 '''
     Summon our options parser
@@ -28,11 +31,11 @@ def GetOptParser():
 
     optionParser.add_argument('--i', '--in',
         action='store',
-        help="Input .fasta file name (or stdin if not set)")
+        help="Input .fasta (may be gzip or BGZF compressed) or .2bit file name (or stdin if not set)")
 
     optionParser.add_argument('--o', '--out',
         action='store',
-        help="Output .fasta file name (or stdout if not set)")
+        help="Output .fasta file name (or stdout if not set), names ending with .gz or .bgz are BGZF compressed")
 
     optionParser.add_argument('--l', '--list',
         action='store',
@@ -42,6 +45,7 @@ def GetOptParser():
         action='append',
         help="Action to perform on entries from .fasta\
         (for some actions user can provide a list file with entry names)\n \
+        Repeat --a to run several actions in one pass, in the given order\n \
         Actions implemented:\t \
         * 'upper' make sequences uppercase, * \n\
         * 'lower' make sequences lowercase, * \n\
@@ -61,10 +65,16 @@ def GetOptParser():
         * 'croptail' keeps only 'range_begin' nucleotides from the start of each sequence. *\n\
         * 'ccrotate' circular rotate sequences so to start with 'range_begin' coordinate *\n\
         * 'listrename' rename fasta entries using list of new names [require --list option] *\n\
-        * 'listsort' sorts fasta entries in order provided in list [require --list option] *\n\
+        * 'listsort' sorts fasta entries in order provided in list [require --list option, loads whole file unless it is the first action on a file] *\n\
         * 'gccontent' prints table of GC content for each entry *\n\
+        * 'stats' prints length, GC, N, soft-masked fraction and base counts for each entry, then totals and N50/L50 *\n\
         ")
 
+    optionParser.add_argument('--j', '--jobs', '--threads',
+        type=int, default=1,
+        help="Number of worker processes, input file is split into chunks of entries [default: 1].\
+        Compressed input is processed on a single core")
+
     optionParser.add_argument('--range_begin',
         type=int, default=0,
         help="For 'pick' action, set first index, for ccrotate set the begin coordinate")
@@ -83,37 +93,52 @@ def GetOptParser():
         type=str, default='seq',
         help="For 'prename' action, set prefix")
 
+    optionParser.add_argument('--iupac',
+        action='store_true',
+        help="For 'revcom' action, complement IUPAC degenerate bases instead of turning them into N,\
+        for --patterns, expand IUPAC degenerate bases")
+
     optionParser.add_argument('--pattern',
         type=str, default='',
         help="For 'crotate' | 'startswith' | 'haspat' | 'pickname' | 'cutbefore' action, set pattern")
 
-    return optionParser
+    optionParser.add_argument('--patterns',
+        action='store',
+        help="For 'crotate' | 'startswith' | 'haspat' | 'pickname' | 'cutbefore' action, file with many patterns\
+        (.fasta or one pattern per line, optionally 'name<TAB>pattern'), used instead of --pattern.\
+        Sequence patterns match case-insensitively")
 
-'''
-    Utility loaders
-'''
+    optionParser.add_argument('--both_strands',
+        action='store_true',
+        help="For --patterns, also search reverse-complement of each pattern")
 
-def ReadFasta(input_lines):
+    optionParser.add_argument('--hits',
+        action='store',
+        help="For --patterns, file to report patterns found in each entry (or stderr if not set)")
 
-    fasta_data = []
+    return optionParser
 
-    for line in input_lines:
-        line = line.rstrip()
-        if len(line) < 1:
-            continue
-        if line[0] == '>':
-            fasta_data.append([line[1:],''])
-        else:
-            fasta_data[-1][1] += line
+'''
+    Utility loaders
 
-    for i, entry in enumerate(fasta_data):
-        fasta_data[i].append(len(entry[1]))
+    Entries are streamed one at a time as [name, seq, len] lists,
+    so memory is bounded by the largest single record
+'''
 
-    return fasta_data
+def ReadFasta(fasta_handle):
+    '''
+        Entries of binary fasta handle, records are cut
+        by seqparse and decoded one at a time
+    '''
+    for title, seq in seqparse.ReadFasta(fasta_handle):
+        entry_seq = seq.decode()
+        yield [title.decode(), entry_seq, len(entry_seq)]
 
 def LoadList(input_list_file):
-
-    selected_entries = defaultdict(lambda: '')
+    '''
+        Hash index of listed names -> new name (or '')
+    '''
+    selected_entries = {}
 
     with open(input_list_file, 'r') as list:
         for line in list:
@@ -125,219 +150,311 @@ def LoadList(input_list_file):
 
     return selected_entries
 
-def WriteFasta(fasta_data, fasta_file):
-
-    for entry in fasta_data:
-        fasta_file.writelines('>{}\n{}\n'.format(entry[0], entry[1]))
+def ReadTwoBit(store, range_from=1, range_to=None, with_seq=True):
+    '''
+        Entries of memory-mapped .2bit store, optionally only
+        an index range and without decoding sequences
+    '''
+    if range_to is None or range_to > len(store):
+        range_to = len(store)
+
+    for i in range(max(range_from, 1) - 1, range_to):
+        if with_seq:
+            seq = store.Fetch(i)
+            yield [store.Name(i), seq, len(seq)]
+        else:
+            yield [store.Name(i), '', store.Length(i)]
 
-revNuc = {
-'A': 'T',
-'T': 'A',
-'G': 'C',
-'C': 'G',
-'a': 't',
-'t': 'a',
-'g': 'c',
-'c': 'g'
-}
-revNucDict = defaultdict(lambda: 'N')
-revNucDict.update(revNuc)
+def ReadListNames(input_list_file):
 
-def RevcomDNA(dna):
-    revcom = ''
-    global revNucDict
+    with open(input_list_file, 'r') as listfile:
+        for line in listfile:
+            yield line.rstrip().split('\t')[0]
+
+def IndexFasta(fasta_handle):
+    '''
+        Hash index of entry name -> byte offsets of its title lines
+        in binary fasta handle
+    '''
+    index = defaultdict(list)
+    offset = 0
+
+    for line in fasta_handle:
+        if line.startswith(b'>'):
+            index[line.rstrip()[1:].decode()].append(offset)
+        offset += len(line)
+
+    return index
+
+def ReadFastaAt(fasta_handle, offset):
+    '''
+        Single entry which title line starts at offset
+    '''
+    fasta_handle.seek(offset)
+    entry_lines = [fasta_handle.readline()]
+    for line in fasta_handle:
+        if line.startswith(b'>'):
+            break
+        entry_lines.append(line)
+
+    return next(ReadFasta(io.BytesIO(b''.join(entry_lines))))
+
+def ReadSortedFasta(fasta_path, list_file):
+    '''
+        'listsort' through the name index: entries are read by
+        seeking in the file, one at a time, in list order
+    '''
+    with seqopen.OpenInput(fasta_path, 'rb', random_access=True) as fasta_handle:
+        index = IndexFasta(fasta_handle)
+        for name in ReadListNames(list_file):
+            for offset in index.get(name, []):
+                yield ReadFastaAt(fasta_handle, offset)
+
+def ReadSortedTwoBit(store, list_file):
+
+    index = defaultdict(list)
+    for i in range(len(store)):
+        index[store.Name(i)].append(i)
+
+    for name in ReadListNames(list_file):
+        for i in index.get(name, []):
+            seq = store.Fetch(i)
+            yield [name, seq, len(seq)]
+
+class AllEntries(object):
+    '''
+        Used in place of the list when no --list is given:
+        every entry name counts as listed, with no new name
+    '''
+    def __contains__(self, key):
+        return True
+
+    def get(self, key, default=None):
+        return default
 
-    for n in dna[::-1]:
-        revcom += revNucDict[n]
+def WriteFasta(fasta_data, fasta_file):
 
-    return revcom
+    for entry in fasta_data:
+        fasta_file.writelines('>{}\n{}\n'.format(entry[0], entry[1]))
 
 '''
     Supported actions
+
+    Every action takes an iterable of entries and yields
+    the processed entries, so actions can be chained lazily
 '''
 
 def Remove(input_fasta_entries, input_defdict, **options):
 
-    filtered_fasta_entries = []
-
     for entry in input_fasta_entries:
-        if input_defdict[entry[0]] == '':
-             filtered_fasta_entries.append(entry)
-
-    input_fasta_entries[:] = list(filtered_fasta_entries)
+        if entry[0] not in input_defdict:
+            yield entry
 
 def Keep(input_fasta_entries, input_defdict, **options):
 
-    filtered_fasta_entries = []
-
     for entry in input_fasta_entries:
-        if input_defdict[entry[0]] != '':
-             filtered_fasta_entries.append(entry)
-
-    input_fasta_entries[:] = list(filtered_fasta_entries)
-
+        if entry[0] in input_defdict:
+            yield entry
 
 def RenameDict(input_fasta_entries, input_defdict, **options):
 
-    for i, entry in enumerate(input_fasta_entries):
-        if input_defdict[entry[0]] != '':
-            input_fasta_entries[i][0] = input_defdict[entry[0]]
+    for entry in input_fasta_entries:
+        new_name = input_defdict.get(entry[0], '')
+        if new_name != '':
+            entry[0] = new_name
+        yield entry
 
 def RenamePrefix(input_fasta_entries, input_defdict, **options):
 
-    entry_counter = 0
+    entry_counter = options.get('entry_offset', 0)
     prefix = options.get('prefix')
-    for i, entry in enumerate(input_fasta_entries):
+    for entry in input_fasta_entries:
         entry_counter += 1
-        input_fasta_entries[i][0] = prefix + str(entry_counter)
+        entry[0] = prefix + str(entry_counter)
+        yield entry
 
 def RenameSplit(input_fasta_entries, input_defdict, **options):
 
     splitter  = options.get('splitter')
     token_num = int(options.get('token'))
 
-    for i, entry in enumerate(input_fasta_entries):
-        new_name = entry[0].split(splitter)[token_num]
-        input_fasta_entries[i][0] = new_name
+    for entry in input_fasta_entries:
+        entry[0] = entry[0].split(splitter)[token_num]
+        yield entry
 
 def UppercaseEntry(input_fasta_entries, input_defdict, **options):
 
-    for i, entry in enumerate(input_fasta_entries):
-        input_fasta_entries[i][1] = input_fasta_entries[i][1].upper()
+    for entry in input_fasta_entries:
+        entry[1] = entry[1].upper()
+        yield entry
 
 def LowercaseEntry(input_fasta_entries, input_defdict, **options):
 
-    for i, entry in enumerate(input_fasta_entries):
-        input_fasta_entries[i][1] = input_fasta_entries[i][1].lower()
+    for entry in input_fasta_entries:
+        entry[1] = entry[1].lower()
+        yield entry
 
 def PickRange(input_fasta_entries, input_defdict, **options):
 
-    filtered_fasta_entries = []
     range_from = int(options.get('range_begin'))
     range_to   = int(options.get('range_end'))
 
-    for i, entry in enumerate(input_fasta_entries):
-        if i+1 >= range_from and i+1 <= range_to:
-            filtered_fasta_entries.append(entry)
-
-    input_fasta_entries[:] = list(filtered_fasta_entries)
+    for i, entry in enumerate(input_fasta_entries, options.get('entry_offset', 0)):
+        if i+1 > range_to:
+            break
+        if i+1 >= range_from:
+            yield entry
+
+def ReportHits(entry_name, hits, **options):
+    '''
+        Print patterns (from --patterns file) found in entry
+    '''
+    labels = []
+    for name, strand in hits:
+        if options.get('both_strands'):
+            name = '{}({})'.format(name, strand)
+        labels.append(name)
+    options.get('hits_file').write('{}\t{}\n'.format(entry_name, ','.join(labels)))
+
+def SearchPattern(pattern):
+    '''
+        Case-insensitive search of single pattern,
+        with no lowercase copy of the sequence
+    '''
+    return re.compile(re.escape(pattern), re.IGNORECASE).search
 
 def CircularRotate(input_fasta_entries, input_defdict, **options):
 
-    pattern = options.get('pattern')
-    for i, entry in enumerate(input_fasta_entries):
-        pos = entry[1].lower().find(pattern.lower())
+    automaton = options.get('automaton')
+    search = SearchPattern(options.get('pattern'))
+    for entry in input_fasta_entries:
+        if automaton is not None:
+            pos = automaton.Leftmost(entry[1])
+        else:
+            match = search(entry[1])
+            pos = match.start() if match else -1
         if pos > 0:
-            rotated = entry[1][pos:] +  entry[1][:pos]
-            input_fasta_entries[i][1] = rotated
+            entry[1] = entry[1][pos:] +  entry[1][:pos]
+        yield entry
 
 def CircularRotateByCoordinate(input_fasta_entries, input_defdict, **options):
 
     coord = int(options.get('range_begin'))
-    for i, entry in enumerate(input_fasta_entries):
+    for entry in input_fasta_entries:
         if len(entry[1]) > coord and coord > 0:
-            rotated = entry[1][coord:] +  entry[1][:coord]
-            input_fasta_entries[i][1] = rotated
+            entry[1] = entry[1][coord:] +  entry[1][:coord]
+        yield entry
 
 def PrintLength(input_fasta_entries, input_defdict, **options):
 
     for entry in input_fasta_entries:
         print('{}\t{}'.format(entry[0], entry[2]))
-    exit()
+    return
+    yield
 
 def StartsWith(input_fasta_entries, input_defdict, **options):
 
-    filtered_fasta_entries = []
+    automaton = options.get('automaton')
     pattern = options.get('pattern')
 
-    for i, entry in enumerate(input_fasta_entries):
-        if entry[1][0:len(pattern)].lower() == pattern.lower():
-            filtered_fasta_entries.append(entry)
-
-    input_fasta_entries[:] = list(filtered_fasta_entries)
+    for entry in input_fasta_entries:
+        if automaton is not None:
+            hits = [(automaton.names[pid], strand) for start, end, pid, strand
+                in automaton.Iter(entry[1], automaton.max_length) if start == 0]
+            if len(hits) > 0:
+                ReportHits(entry[0], sorted(set(hits)), **options)
+                yield entry
+        elif entry[1][0:len(pattern)].lower() == pattern.lower():
+            yield entry
 
 def HasPattern(input_fasta_entries, input_defdict, **options):
 
-    filtered_fasta_entries = []
-    pattern = options.get('pattern')
-
-    for i, entry in enumerate(input_fasta_entries):
-        if pattern.lower() in entry[1].lower():
-            filtered_fasta_entries.append(entry)
+    automaton = options.get('automaton')
+    search = SearchPattern(options.get('pattern'))
 
-    input_fasta_entries[:] = list(filtered_fasta_entries)
+    for entry in input_fasta_entries:
+        if automaton is not None:
+            hits = automaton.Hits(entry[1])
+            if len(hits) > 0:
+                ReportHits(entry[0], hits, **options)
+                yield entry
+        elif search(entry[1]):
+            yield entry
 
 def RevcomEntries(input_fasta_entries, input_defdict, **options):
 
-    for i, entry in enumerate(input_fasta_entries):
-        input_fasta_entries[i][1] = RevcomDNA(entry[1])
+    for entry in input_fasta_entries:
+        entry[1] = nucleotides.RevcomDNA(entry[1], options.get('iupac'))
+        yield entry
 
 def Pickname(input_fasta_entries, input_defdict, **options):
 
-    filtered_fasta_entries = []
+    automaton = options.get('name_automaton')
     pattern = options.get('pattern')
 
     for entry in input_fasta_entries:
-        if pattern in entry[0]:
-             filtered_fasta_entries.append(entry)
-
-    input_fasta_entries[:] = list(filtered_fasta_entries)
+        if automaton is not None:
+            hits = automaton.Hits(entry[0])
+            if len(hits) > 0:
+                ReportHits(entry[0], hits, **options)
+                yield entry
+        elif pattern in entry[0]:
+            yield entry
 
 def Cutbefore(input_fasta_entries, input_defdict, **options):
 
-    filtered_fasta_entries = []
+    automaton = options.get('automaton')
     pattern = options.get('pattern')
-
+    pcount = max(int(options.get('range_begin')), 1)
 
     for entry in input_fasta_entries:
-        pcount = int(options.get('range_begin'))
-        if entry[1].count(pattern) >= pcount:
+        if automaton is not None:
+            starts = automaton.Starts(entry[1])
+            start = starts[pcount-1] if len(starts) >= pcount else -1
+        else:
             start = entry[1].find(pattern)
-            while start >= 0 and pcount > 1:
+            for i in range(pcount - 1):
+                if start < 0:
+                    break
                 start = entry[1].find(pattern, start+len(pattern))
-                pcount -= 1
-            left_n = entry[0] + "_Left"
-            right_n = entry[0] + "_Right"
+        if start >= 0:
             left = entry[1][:start]
             right = entry[1][start:]
-            filtered_fasta_entries.append([left_n, left])
-            filtered_fasta_entries.append([right_n, right])
+            yield [entry[0] + "_Left", left, len(left)]
+            yield [entry[0] + "_Right", right, len(right)]
         else:
-            filtered_fasta_entries.append(entry)
-
-    input_fasta_entries[:] = list(filtered_fasta_entries)
+            yield entry
 
 def Croptail(input_fasta_entries, input_defdict, **options):
 
     plen = int(options.get('range_begin'))
-    for i, entry in enumerate(input_fasta_entries):
-        input_fasta_entries[i][1] = input_fasta_entries[i][1][:plen]
+    for entry in input_fasta_entries:
+        entry[1] = entry[1][:plen]
+        entry[2] = len(entry[1])
+        yield entry
 
 def RenameList(input_fasta_entries, input_defdict, **options):
-    names = []
-    with open(options.get('list'), 'r') as listfile:
-        for line in listfile:
-            names.append(line.rstrip().split('\t')[0])
 
-    for i, entry in enumerate(input_fasta_entries):
-        if i < len(names):
-            input_fasta_entries[i][0] = names[i]
+    names = islice(ReadListNames(options.get('list')), options.get('entry_offset', 0), None)
+    for entry in input_fasta_entries:
+        entry[0] = next(names, entry[0])
+        yield entry
 
 def SortList(input_fasta_entries, input_defdict, **options):
-    order = []
-    with open(options.get('list'), 'r') as listfile:
-        for line in listfile:
-            order.append(line.rstrip().split('\t')[0])
-    sorted_fasta_entries = []
+    '''
+        Whole-file action: has to hold every entry in memory,
+        unless it is the first action on a file (see ReadSortedFasta)
+    '''
+    index = defaultdict(list)
+    for entry in input_fasta_entries:
+        index[entry[0]].append(entry)
 
-    for name in order:
-        for entry in input_fasta_entries:
-            if entry[0] == name:
-                sorted_fasta_entries.append(entry)
-    input_fasta_entries[:] = list(sorted_fasta_entries)
+    for name in ReadListNames(options.get('list')):
+        for entry in index.get(name, []):
+            yield entry
 
 def GcContent(input_fasta_entries, input_defdict, **options):
-    for i, entry in enumerate(input_fasta_entries):
+    for entry in input_fasta_entries:
         gc = 0.0
         for nuc in entry[1].upper():
             if nuc == 'G' or nuc == 'C':
@@ -346,7 +463,82 @@ def GcContent(input_fasta_entries, input_defdict, **options):
         gc = int(gc * 10000)
         gc = float(gc) / 100
         print('{}\t{}\t{}'.format(entry[0], gc, entry[2]))
-    exit()
+    return
+    yield
+
+LOWERCASE = bytes(range(ord('a'), ord('z') + 1))
+
+def SequenceStats(seq):
+    '''
+        Base counts of one sequence: A, C, G, T, N, other
+        and soft-masked (lowercase) bases, each is a C-level scan
+    '''
+    data = seq.encode('ascii', 'replace')
+    counts = [data.count(base) + data.count(base.lower()) for base in (b'A', b'C', b'G', b'T', b'N')]
+    counts.append(len(data) - sum(counts))
+    counts.append(len(data) - len(data.translate(None, LOWERCASE)))
+
+    return counts
+
+def NStats(lengths, fraction=0.5):
+    '''
+        N50 and L50 (or other fraction) of entry lengths
+    '''
+    target = sum(lengths) * fraction
+    covered = 0
+    for i, length in enumerate(sorted(lengths, reverse=True)):
+        covered += length
+        if covered >= target and length > 0:
+            return length, i + 1
+
+    return 0, 0
+
+def GcPercent(counts, length):
+
+    if length == 0:
+        return 0.0
+    return 100.0 * (counts[1] + counts[2]) / length
+
+STATS_HEADER = '#name\tlength\tgc_percent\tA\tC\tG\tT\tN\tother\tsoftmasked_fraction'
+
+def PrintStats(input_fasta_entries, input_defdict, **options):
+    '''
+        In parallel runs caller passes 'stats_summary' to collect
+        lengths and totals, and prints header and summary itself
+    '''
+    summary = options.get('stats_summary')
+    if summary is None:
+        print(STATS_HEADER)
+        lengths, totals = [], [0] * 7
+    else:
+        lengths, totals = summary
+
+    for entry in input_fasta_entries:
+        counts = SequenceStats(entry[1])
+        length = len(entry[1])
+        lengths.append(length)
+        for i, c in enumerate(counts):
+            totals[i] += c
+        print('{}\t{}\t{:.2f}\t{}\t{:.4f}'.format(entry[0], length,
+            GcPercent(counts, length), '\t'.join(str(c) for c in counts[:6]),
+            float(counts[6]) / length if length > 0 else 0.0))
+
+    if summary is None:
+        PrintStatsSummary(lengths, totals)
+    return
+    yield
+
+def PrintStatsSummary(lengths, totals):
+
+    total_length = sum(lengths)
+    n50, l50 = NStats(lengths)
+    print('#entries\t{}'.format(len(lengths)))
+    print('#total_length\t{}'.format(total_length))
+    print('#gc_percent\t{:.2f}'.format(GcPercent(totals, total_length)))
+    print('#N\t{}'.format(totals[4]))
+    print('#softmasked_fraction\t{:.4f}'.format(float(totals[6]) / total_length if total_length > 0 else 0.0))
+    print('#N50\t{}'.format(n50))
+    print('#L50\t{}'.format(l50))
 
 ACTIONS = {
 'upper' :    UppercaseEntry,
@@ -368,29 +560,230 @@ ACTIONS = {
 'ccrotate' : CircularRotateByCoordinate,
 'listrename' : RenameList,
 'listsort' : SortList,
-'gccontent' : GcContent
+'gccontent' : GcContent,
+'stats' : PrintStats
 }
 
+# actions that can't stream and load every entry into memory
+WHOLE_FILE_ACTIONS = set(['listsort'])
+
+# actions that can't run without --list
+LIST_ACTIONS = set(['listrename', 'listsort'])
+
+# actions that print a report instead of writing .fasta,
+# they can only be the last step of a pipeline
+REPORT_ACTIONS = set(['falength', 'gccontent', 'stats'])
+
+# one entry in, one entry out, only the sequence is changed
+SEQUENCE_TRANSFORMS = set(['upper', 'lower', 'revcom', 'croptail', 'crotate', 'ccrotate'])
+
+# filters that look only at entry name or entry index
+NAME_FILTERS = set(['keep', 'remove', 'pickname', 'pick'])
+
+# actions that never touch the sequence
+NAME_ACTIONS = NAME_FILTERS | set(['lrename', 'srename', 'prename', 'listrename'])
+
+# one entry in, one entry out
+ONE_TO_ONE_ACTIONS = SEQUENCE_TRANSFORMS | set(['lrename', 'srename', 'prename', 'listrename'])
+
+# actions that depend on entry position in the whole stream,
+# in parallel runs they get 'entry_offset' of their chunk
+POSITIONAL_ACTIONS = set(['prename', 'pick', 'listrename'])
+
+'''
+    Pipeline compiler
+'''
+
+def CompilePipeline(action_names, list_file=None):
+
+    for name in action_names:
+        if name not in ACTIONS:
+            raise ValueError('Unknown action \'{}\''.format(name))
+
+    for name in action_names:
+        if name in LIST_ACTIONS and list_file is None:
+            raise ValueError('Action \'{}\' requires --list option'.format(name))
+
+    for name in action_names[:-1]:
+        if name in REPORT_ACTIONS:
+            raise ValueError('Action \'{}\' prints a report and must be the last one'.format(name))
+
+    # move cheap name filters in front of sequence transforms
+    # they don't depend on, so dropped entries are never transformed
+    pipeline = []
+    for name in action_names:
+        pos = len(pipeline)
+        if name in NAME_FILTERS:
+            while pos > 0 and pipeline[pos-1] in SEQUENCE_TRANSFORMS:
+                pos -= 1
+        pipeline.insert(pos, name)
+
+    return pipeline
+
+def RunPipeline(fasta_data, pipeline, input_defdict, entry_offsets={}, **options):
+
+    for stage, name in enumerate(pipeline):
+        stage_options = options
+        if stage in entry_offsets:
+            stage_options = dict(options, entry_offset=entry_offsets[stage])
+        fasta_data = ACTIONS[name](fasta_data, input_defdict, **stage_options)
+
+    return fasta_data
+
+'''
+    Parallel runs over byte-range chunks
+
+    Input file is split into byte ranges aligned to '>' lines and
+    every chunk runs the whole pipeline in a worker process.
+    Positional actions need entries counts of all chunks before
+    them: for each positional stage one extra pass counts entries
+    reaching that stage in every chunk (with offsets of earlier
+    stages already known), prefix sums give per-chunk offsets.
+'''
+
+WORKER = {}
+
+def InitWorker(fasta_path, pipeline, input_defdict, options):
+    WORKER.update(path=fasta_path, pipeline=pipeline, defdict=input_defdict, options=options)
+
+def ReadChunk(start, end):
+
+    with open(WORKER['path'], 'rb') as fasta_handle:
+        fasta_handle.seek(start)
+        return fasta_handle.read(end - start)
+
+def CountChunk(task):
+    '''
+        Number of entries of the chunk reaching stage
+    '''
+    start, end, stage, entry_offsets = task
+    data = ReadChunk(start, end)
+    pipeline = WORKER['pipeline'][:stage]
+
+    if set(pipeline) <= ONE_TO_ONE_ACTIONS:
+        return data.count(b'\n>') + data.startswith(b'>')
+
+    options = dict(WORKER['options'], hits_file=io.StringIO())
+    fasta_data = ReadFasta(io.BytesIO(data))
+    return sum(1 for entry in RunPipeline(fasta_data, pipeline, WORKER['defdict'], entry_offsets, **options))
+
+def RunChunk(task):
+    '''
+        Pipeline output of the chunk: .fasta text, printed
+        reports, pattern hits and stats summary parts
+    '''
+    start, end, entry_offsets = task
+    data = ReadChunk(start, end)
+
+    fasta_text = io.StringIO()
+    report_text = io.StringIO()
+    options = dict(WORKER['options'], hits_file=io.StringIO(), stats_summary=([], [0] * 7))
+
+    stdout = sys.stdout
+    sys.stdout = report_text
+    try:
+        fasta_data = ReadFasta(io.BytesIO(data))
+        WriteFasta(RunPipeline(fasta_data, WORKER['pipeline'], WORKER['defdict'], entry_offsets, **options), fasta_text)
+    finally:
+        sys.stdout = stdout
+
+    return fasta_text.getvalue(), report_text.getvalue(), options['hits_file'].getvalue(), options['stats_summary']
+
+def RunParallel(fasta_path, pipeline, input_defdict, jobs, fasta_file, **options):
+
+    # a few chunks per worker to even out the load, at least 1 MB each
+    chunks = seqparse.FastaChunks(fasta_path, jobs)
+    worker_options = dict((k, v) for k, v in options.items() if k != 'hits_file')
+    pool = multiprocessing.Pool(jobs, initializer=InitWorker,
+        initargs=(fasta_path, pipeline, input_defdict, worker_options))
+
+    offsets = [{} for chunk in chunks]
+    for stage, name in enumerate(pipeline):
+        if name not in POSITIONAL_ACTIONS:
+            continue
+        counts = pool.map(CountChunk, [(start, end, stage, offsets[i]) for i, (start, end) in enumerate(chunks)])
+        offset = 0
+        for i, count in enumerate(counts):
+            offsets[i][stage] = offset
+            offset += count
+
+    if 'stats' in pipeline:
+        print(STATS_HEADER)
+    lengths, totals = [], [0] * 7
+    tasks = [(start, end, offsets[i]) for i, (start, end) in enumerate(chunks)]
+    for fasta_text, report_text, hits_text, stats_summary in pool.imap(RunChunk, tasks):
+        fasta_file.write(fasta_text)
+        sys.stdout.write(report_text)
+        if len(hits_text) > 0:
+            options.get('hits_file').write(hits_text)
+        lengths.extend(stats_summary[0])
+        totals = [t + c for t, c in zip(totals, stats_summary[1])]
+    if 'stats' in pipeline:
+        PrintStatsSummary(lengths, totals)
+
+    pool.close()
+    pool.join()
+
 if __name__ == '__main__':
 
     runArgs = GetOptParser().parse_args(sys.argv[1:])
 
-    inputSource = sys.stdin
-    if runArgs.i is not None:
-        if os.path.isfile(runArgs.i):
-            inputSource = open(runArgs.i, 'r')
-
+    # gzip and BGZF input is detected and decompressed transparently,
+    # it is opened below only on the serial streaming path
+    inputFile   = None
+    inputStore  = None
+    inputSource = None
+    if runArgs.i is not None and os.path.isfile(runArgs.i):
+        inputFile = runArgs.i
+        if twobit.IsTwoBit(inputFile):
+            inputStore = twobit.TwoBitFile(inputFile)
+
+    # output named .gz or .bgz is BGZF compressed
     outputDest = sys.stdout
     if runArgs.o is not None:
         try:
-            outputDest = open(runArgs.o, 'w')
+            outputDest = seqopen.OpenOutput(runArgs.o)
         except IOError:
             sys.stderr.writelines('Error: unable to open output file {},\
             writing to stdout instead\n'.format(runArgs.o))
             outputDest = sys.stdout
 
-    # load fasta entries
-    fasta_data = ReadFasta(inputSource)
+    if runArgs.a is None:
+        sys.stderr.write('No action specified!\nExiting with an error!')
+        exit()
+
+    try:
+        pipeline = CompilePipeline(runArgs.a, runArgs.l)
+    except ValueError as err:
+        sys.stderr.write('{}!\nExiting with an error!'.format(err))
+        exit()
+
+    # whole-file actions and non-file inputs run serially
+    parallel = runArgs.j > 1 and inputStore is None and inputFile is not None and not seqopen.IsGzip(inputFile)
+    if parallel and len(WHOLE_FILE_ACTIONS & set(pipeline)) > 0:
+        sys.stderr.write('Whole-file action in pipeline, running on a single core\n')
+        parallel = False
+
+    # stream fasta entries
+    if pipeline[0] == 'listsort' and inputStore is not None:
+        fasta_data = ReadSortedTwoBit(inputStore, runArgs.l)
+        pipeline = pipeline[1:]
+    elif pipeline[0] == 'listsort' and inputFile is not None and (not seqopen.IsGzip(inputFile) or seqopen.IsBgzf(inputFile)):
+        # leading 'listsort' seeks entries through name index of the file
+        fasta_data = ReadSortedFasta(runArgs.i, runArgs.l)
+        pipeline = pipeline[1:]
+    elif inputStore is not None:
+        # .2bit store has random access: leading 'pick' reads only
+        # its index range and 'falength' needs no sequence decoding
+        range_from, range_to = 1, None
+        if pipeline[0] == 'pick':
+            range_from, range_to = runArgs.range_begin, runArgs.range_end
+            pipeline = pipeline[1:]
+        with_seq = not (len(pipeline) > 0 and pipeline[-1] == 'falength' and set(pipeline[:-1]) <= NAME_ACTIONS)
+        fasta_data = ReadTwoBit(inputStore, range_from, range_to, with_seq)
+    elif not parallel:
+        inputSource = seqopen.OpenInput(inputFile, 'rb')
+        fasta_data = ReadFasta(inputSource)
     options = {
         'splitter' : runArgs.splitter,
         'token' : runArgs.token,
@@ -398,15 +791,26 @@ if __name__ == '__main__':
         'range_begin': runArgs.range_begin,
         'range_end': runArgs.range_end,
         'pattern' : runArgs.pattern,
+        'iupac' : runArgs.iupac,
         'list' : runArgs.l
     }
 
-    # here is a good place to sort entries
-    # if necessary
-
-
-    selectedEntries = defaultdict(lambda: 0)
-    [selectedEntries.update({name[0]:1}) for name in fasta_data]
+    if runArgs.patterns is not None:
+        try:
+            patterns = motifs.LoadPatterns(runArgs.patterns)
+            options['automaton'] = motifs.PatternAutomaton(patterns,
+                both_strands=runArgs.both_strands, iupac=runArgs.iupac)
+            if 'pickname' in pipeline:
+                options['name_automaton'] = motifs.PatternAutomaton(patterns, ignore_case=False)
+        except (IOError, ValueError) as err:
+            sys.stderr.write('Error: unable to load patterns from {}: {}\nExiting with an error!'.format(runArgs.patterns, err))
+            exit()
+        options['both_strands'] = runArgs.both_strands
+        options['hits_file'] = sys.stderr
+        if runArgs.hits is not None:
+            options['hits_file'] = open(runArgs.hits, 'w')
+
+    selectedEntries = AllEntries()
 
     if runArgs.l is not None:
         try:
@@ -416,10 +820,13 @@ if __name__ == '__main__':
             sys.stderr.writelines('Error: unable read list file {},\
             acting on all entries in .fasta\n'.format(runArgs.l))
 
-    actionFunc = ACTIONS[runArgs.a[0]]
-
-    actionFunc(fasta_data, selectedEntries, **options)
-
-    WriteFasta(fasta_data, outputDest)
+    # all actions run fused over a single parse and a single write
+    if parallel:
+        RunParallel(runArgs.i, pipeline, selectedEntries, runArgs.j, outputDest, **options)
+    else:
+        WriteFasta(RunPipeline(fasta_data, pipeline, selectedEntries, **options), outputDest)
 
-    #outputDest.close()
+    if inputSource is not None:
+        inputSource.close()
+    if outputDest is not sys.stdout:
+        outputDest.close()
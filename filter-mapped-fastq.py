@@ -3,38 +3,223 @@
     that reads, not listed in input
     reads list file
 
-
     run example (results are printed in stdout):
     ./filter-mapped_fastq.py input.fastq input.list
 
+    names may come straight from aligner SAM output
+    (file or stdin '-'), mapped reads are listed by default:
+    samtools view aln.bam | ./filter-mapped_fastq.py input.fastq --sam -
+
+    paired reads are filtered in one pass, both mates are kept
+    or dropped together, /1 and /2 name suffixes are ignored:
+    ./filter-mapped_fastq.py R1.fastq input.list --r2 R2.fastq --o R1.out.fastq --o2 R2.out.fastq
+
+    all files may be gzip compressed
+
+    listed names are kept as a sorted array of 64-bit
+    hashes (nameset.py), 8 bytes per name, with a Bloom
+    filter in front for lists of BLOOM_MIN_NAMES and more
+
+    reads are framed in 4 MB blocks (seqparse.ReadFastqBlocks)
+    and written back as slices of the block
+
 '''
 
-import sys
-from collections import defaultdict
-from itertools import islice
+import sys, os, resource, argparse
+
+import seqopen, seqparse, nameset
+
+BLOOM_MIN_NAMES = 2**24
+
+
+def GetOptParser():
+
+    optionParser = argparse.ArgumentParser()
+
+    optionParser.add_argument('fastq',
+        help="Input .fastq file (R1 of paired reads)")
+
+    optionParser.add_argument('list', nargs='?',
+        help="File with names of reads to drop, one per line")
+
+    optionParser.add_argument('--sam',
+        action='store',
+        help="SAM file (or '-' for stdin) to take names of reads to drop from, instead of list")
+
+    optionParser.add_argument('--sam-reads',
+        action='store',
+        choices=['mapped', 'unmapped'],
+        default='mapped',
+        help="Drop reads of SAM records with FLAG bit 4 unset (mapped) or set (unmapped) [mapped]")
+
+    optionParser.add_argument('--r2',
+        action='store',
+        help="Input .fastq file of R2 mates, filtered in lockstep with the first one")
+
+    optionParser.add_argument('--o', '--out',
+        action='store',
+        help="Output .fastq file name (or stdout if not set), names ending with .gz or .bgz are BGZF compressed")
+
+    optionParser.add_argument('--o2',
+        action='store',
+        help="Output .fastq file name of R2 mates")
+
+    return optionParser
+
+def ReadNames(runArgs):
+    '''
+        Name hashes of list or SAM and number of names read
+    '''
+    mates = runArgs.r2 is not None
+    if runArgs.sam is not None:
+        with seqopen.OpenInput(None if runArgs.sam == '-' else runArgs.sam, 'rb') as sam:
+            return nameset.ReadSamNames(sam, unmapped=runArgs.sam_reads == 'unmapped', mates=mates)
 
-listed_read_counter = 0
-mapped_reads_list = defaultdict(lambda : 0)
+    with seqopen.OpenInput(runArgs.list, 'rb') as imapped:
+        return nameset.ReadNameList(imapped, mates=mates)
 
-with open(sys.argv[2], 'r') as imapped:
-    for line in imapped:
-        mapped_reads_list[line.rstrip()] = 1
-        listed_read_counter += 1
+def RecordHashes(block, mates=False):
+    '''
+        Hashes of read names (header up to the first space)
+        of block of records from seqparse.ReadFastqBlocks
+    '''
+    import numpy as np
 
+    data, starts, header_ends = block
+    codes = np.frombuffer(data, dtype=np.uint8)
+    name_starts = starts[:-1] + 1
+    spaces = np.flatnonzero(codes[starts[0]:starts[-1]] == ord(' ')) + starts[0]
+    following = spaces[np.minimum(np.searchsorted(spaces, name_starts), len(spaces) - 1)] if len(spaces) else header_ends
+    name_ends = np.where((following >= name_starts) & (following < header_ends), following, header_ends)
+    if mates:
+        suffix = ((name_ends - name_starts >= 2) & (codes[name_ends - 2] == ord('/')) &
+            ((codes[name_ends - 1] == ord('1')) | (codes[name_ends - 1] == ord('2'))))
+        name_ends = name_ends - 2 * suffix
 
-total_read_counter   = 0
-printed_read_counter = 0
-with open(sys.argv[1], 'r') as infile:
+    return nameset.HashRanges(codes, name_starts, name_ends)
+
+def SliceRecords(block, begin, end):
+    data, starts, header_ends = block
+
+    return data, starts[begin:end + 1], header_ends[begin:end]
+
+def KeptSlices(block, kept):
+    '''
+        memoryview slices of block, one per run of kept records
+    '''
+    import numpy as np
+
+    data, starts, header_ends = block
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], kept, [0]]).astype(np.int8)))
+    offsets = starts[edges].tolist()
+    view = memoryview(data)
+
+    return [view[begin:end] for begin, end in zip(offsets[0::2], offsets[1::2])]
+
+def Lockstep(blocks1, blocks2):
+    '''
+        Pairs of blocks with the same number of records
+        from two streams of FASTQ blocks
+    '''
+    block1 = block2 = None
     while True:
-        read_data = list(islice(infile, 4))
-        if not read_data:
-            break
-        read_name = read_data[0].split(' ')[0][1:]
-        if mapped_reads_list[read_name] == 0:
-            sys.stdout.write('{}{}{}{}'.format(read_data[0], read_data[1], read_data[2], read_data[3]))
-            printed_read_counter += 1
-        total_read_counter += 1
-
-sys.stderr.write('Total reads: {}\n'.format(total_read_counter))
-sys.stderr.write('Selected reads: {}\n'.format(printed_read_counter))
-sys.stderr.write('Size of list: {}\n'.format(listed_read_counter))
+        if block1 is None or len(block1[2]) == 0:
+            block1 = next(blocks1, None)
+        if block2 is None or len(block2[2]) == 0:
+            block2 = next(blocks2, None)
+        if block1 is None or block2 is None:
+            if block1 is not None or block2 is not None:
+                raise ValueError('R2 has {} reads than R1'.format('fewer' if block2 is None else 'more'))
+            return
+
+        count = min(len(block1[2]), len(block2[2]))
+        yield SliceRecords(block1, 0, count), SliceRecords(block2, 0, count)
+        block1 = SliceRecords(block1, count, len(block1[2]))
+        block2 = SliceRecords(block2, count, len(block2[2]))
+
+def FilterSingle(blocks, mapped_reads, output):
+    '''
+        Writes unlisted reads, returns number of
+        reads and of reads written
+    '''
+    total = selected = 0
+    for block in blocks:
+        kept = ~mapped_reads.Contains(RecordHashes(block))
+        output.writelines(KeptSlices(block, kept))
+        total += len(kept)
+        selected += int(kept.sum())
+
+    return total, selected
+
+def FilterPairs(blocks1, blocks2, mapped_reads, output1, output2):
+    '''
+        Writes pairs with neither mate listed, returns
+        number of pairs and of pairs written
+    '''
+    import numpy as np
+
+    total = selected = 0
+    for block1, block2 in Lockstep(blocks1, blocks2):
+        hashes = RecordHashes(block1, mates=True)
+        mismatch = np.flatnonzero(hashes != RecordHashes(block2, mates=True))
+        if len(mismatch) > 0:
+            headers = [block[0][block[1][mismatch[0]] + 1:block[2][mismatch[0]]] for block in (block1, block2)]
+            raise ValueError('Mates out of order: {} and {}'.format(*[header.decode(errors='replace') for header in headers]))
+
+        kept = ~mapped_reads.Contains(hashes)
+        output1.writelines(KeptSlices(block1, kept))
+        output2.writelines(KeptSlices(block2, kept))
+        total += len(kept)
+        selected += int(kept.sum())
+
+    return total, selected
+
+
+if __name__ == '__main__':
+
+    runArgs = GetOptParser().parse_args(sys.argv[1:])
+    if (runArgs.list is None) == (runArgs.sam is None):
+        sys.stderr.write('Give either a list file or --sam.\nExiting with an error!')
+        exit()
+    if (runArgs.r2 is None) != (runArgs.o2 is None) or (runArgs.r2 is not None and runArgs.o is None):
+        sys.stderr.write('Paired reads need --r2, --o and --o2.\nExiting with an error!')
+        exit()
+    for path in (runArgs.fastq, runArgs.list, runArgs.r2, None if runArgs.sam == '-' else runArgs.sam):
+        if path is not None and not os.path.isfile(path):
+            sys.stderr.write('No such file {}.\nExiting with an error!'.format(path))
+            exit()
+
+    try:
+        hashes, listed_read_counter = ReadNames(runArgs)
+    except ValueError as err:
+        sys.stderr.write('{}.\nExiting with an error!'.format(err))
+        exit()
+    mapped_reads = nameset.NameSet(hashes, bloom=len(hashes) >= BLOOM_MIN_NAMES)
+    del hashes
+
+    try:
+        if runArgs.r2 is None:
+            output = sys.stdout.buffer if runArgs.o is None else seqopen.OpenOutput(runArgs.o, 'wb')
+            with seqopen.OpenInput(runArgs.fastq, 'rb') as infile:
+                total_read_counter, printed_read_counter = FilterSingle(seqparse.ReadFastqBlocks(infile), mapped_reads, output)
+            output.flush()
+            if output is not sys.stdout.buffer:
+                output.close()
+            read_label = 'reads'
+        else:
+            with seqopen.OpenInput(runArgs.fastq, 'rb') as infile1, seqopen.OpenInput(runArgs.r2, 'rb') as infile2, \
+                seqopen.OpenOutput(runArgs.o, 'wb') as output1, seqopen.OpenOutput(runArgs.o2, 'wb') as output2:
+                total_read_counter, printed_read_counter = FilterPairs(seqparse.ReadFastqBlocks(infile1),
+                    seqparse.ReadFastqBlocks(infile2), mapped_reads, output1, output2)
+            read_label = 'read pairs'
+    except ValueError as err:
+        sys.stderr.write('{}.\nExiting with an error!'.format(err))
+        exit()
+
+    sys.stderr.write('Total {}: {}\n'.format(read_label, total_read_counter))
+    sys.stderr.write('Selected {}: {}\n'.format(read_label, printed_read_counter))
+    sys.stderr.write('Size of list: {}\n'.format(listed_read_counter))
+    sys.stderr.write('Name set memory: {:.1f} MB ({} unique names)\n'.format(mapped_reads.nbytes / 2**20, len(mapped_reads)))
+    # ru_maxrss is in bytes on macOS, in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stderr.write('Peak memory: {:.1f} MB\n'.format(peak_rss / (2**20 if sys.platform == 'darwin' else 2**10)))
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 import sys, os, argparse
+from collections import defaultdict
+
+import faidx, nucleotides, seqopen, seqparse, twobit
 
 
 def GetOptParser():
@@ -8,69 +11,236 @@ def GetOptParser():
 
     optionParser.add_argument('--i', '--in',
         action='store',
-        help="Input .fasta file name (or stdin if not set)")
+        help="Input .fasta (may be gzip or BGZF compressed) or .2bit file name (or stdin if not set)")
 
     optionParser.add_argument('--o', '--out',
         action='store',
-        help="Output .fasta file name (or stdout if not set)")
+        help="Output .fasta file name (or stdout if not set), names ending with .gz or .bgz are BGZF compressed")
 
     optionParser.add_argument('--l', '--locus',
         action='store',
         help="Locus description in format Chr1,start,end or just Chr1.\nIn 1-based coordinate system")
 
+    optionParser.add_argument('--b', '--bed', '--regions',
+        action='store',
+        help="File with many loci, extracted in one run: BED lines (tab-separated,\n\
+        0-based start, optional name and strand columns) or Chr1,start,end[,strand] lines")
+
+    optionParser.add_argument('--strand',
+        action='store_true',
+        help="Reverse-complement regions on '-' strand")
+
     optionParser.add_argument('--s', '--space',
         action='store_true',
-        help="Store only prefix of fasta entry name before first space character")
+        help="Match only prefix of fasta entry name before first space character (default)")
+
+    optionParser.add_argument('--exact',
+        action='store_true',
+        help="Match full fasta entry title, spaces included")
 
     return optionParser
 
 
-def ReadFasta(input_lines, split_space = False):
+def EntryName(title, split_space = False):
+
+    entry_name = title.decode()
+    if split_space == True:
+        entry_name = entry_name.split(' ')[0]
+
+    return entry_name
+
+def ReadEntries(fasta_handle, entry_names, split_space = False):
+    '''
+        Sequential scan for input without index (e.g. stdin),
+        yields (name, sequence) of entries with names in
+        entry_names, sequences of other entries are skipped
+    '''
+    selected = lambda title: EntryName(title, split_space) in entry_names
+    for title, seq in seqparse.ReadFasta(fasta_handle, selected):
+        yield EntryName(title, split_space), seq.decode()
 
-    fasta_data = []
+def ReadFasta(fasta_handle, entry_name, split_space = False):
+    '''
+        Sequence of entry with matching name,
+        the last one of same-named wins
+    '''
+    selected_seq = None
+    for name, seq in ReadEntries(fasta_handle, set([entry_name]), split_space):
+        selected_seq = seq
 
-    for line in input_lines:
-        line = line.rstrip()
-        if len(line) < 1:
+    return selected_seq
+
+def CheckLocus(cut_from, cut_to, seq_len):
+    '''
+        Returns error message for bad locus coordinates or None
+    '''
+    if cut_from == 0 and cut_to == 0:
+        return None
+    elif cut_to > seq_len:
+        return 'End coordinate {} is out of scaffold\'s length {}!'.format(cut_to, seq_len)
+    elif cut_from < 1 or cut_to < cut_from:
+        return 'Can get such locus.\nPlease check --locus key again.'
+    return None
+
+'''
+    Batch extraction
+'''
+
+def ParseRegions(region_lines):
+    '''
+        List of regions [entry_name, cut_from, cut_to, strand, title]
+        in the 1-based closed coordinates of --locus. Lines with tabs
+        are BED (0-based, end-exclusive), others are Chr1,start,end
+        with optional strand or just Chr1 (cut_from = cut_to = 0)
+    '''
+    regions = []
+
+    for line_number, line in enumerate(region_lines, 1):
+        line = line.rstrip('\r\n')
+        if len(line.strip()) < 1 or line.startswith(('#', 'track', 'browser')):
             continue
-        if line[0] == '>':
-            if split_space == False:
-                fasta_data.append([line[1:],''])
+        try:
+            if '\t' in line:
+                toks = line.split('\t')
+                entry_name = toks[0]
+                cut_from   = int(toks[1]) + 1
+                cut_to     = int(toks[2])
+                title = toks[3] if len(toks) > 3 and toks[3] not in ('', '.') else None
+                strand = toks[5] if len(toks) > 5 else '+'
             else:
-                fasta_data.append([line[1:].split(' ')[0],''])
-        else:
-            fasta_data[-1][1] += line
+                toks = line.split(',')
+                entry_name = toks[0]
+                cut_from   = 0
+                cut_to     = 0
+                title  = None
+                strand = '+'
+                if len(toks) in (3, 4):
+                    cut_from = int(toks[1])
+                    cut_to   = int(toks[2])
+                    if len(toks) == 4:
+                        strand = toks[3].strip()
+                elif len(toks) != 1:
+                    raise ValueError
+        except (IndexError, ValueError):
+            raise ValueError('Wrong region format at line {}: {}'.format(line_number, line))
+
+        if title is None:
+            title = entry_name
+            if cut_from != 0 or cut_to != 0:
+                title = '{}:{}-{}'.format(entry_name, cut_from, cut_to)
+        regions.append([entry_name, cut_from, cut_to, strand, title])
+
+    return regions
 
-    for i, entry in enumerate(fasta_data):
-        fasta_data[i].append(len(entry[1]))
+def GroupRegions(regions):
+    '''
+        Region indexes grouped by entry name, sorted by start
+    '''
+    by_entry = defaultdict(list)
+    for i, region in enumerate(regions):
+        by_entry[region[0]].append(i)
+    for region_ids in by_entry.values():
+        region_ids.sort(key=lambda i: regions[i][1])
 
-    return fasta_data
+    return by_entry
+
+def CutRegions(regions, region_ids, seq_len, fetch, extracted, errors):
+    '''
+        Extract regions of one entry, fetch(start, end) returns
+        its sequence in 0-based end-exclusive range
+    '''
+    for i in region_ids:
+        entry_name, cut_from, cut_to, strand, title = regions[i]
+        error = CheckLocus(cut_from, cut_to, seq_len)
+        if error is not None:
+            errors[i] = error
+            continue
+        if cut_from == 0 and cut_to == 0:
+            cut_from, cut_to = 1, seq_len
+        extracted[i] = fetch(cut_from-1, cut_to)
+        errors.pop(i, None)
+
+def ExtractRegions(regions, split_space, genome_store=None, fasta_index=None, fasta_handle=None):
+    '''
+        Sequences of all regions (None where extraction failed) and
+        error messages by region index. Entries are looked up once
+        each, by name in the store or index, or else in a single
+        sequential pass over fasta_handle
+    '''
+    extracted = [None] * len(regions)
+    errors = {}
+    by_entry = GroupRegions(regions)
+    for entry_name, region_ids in by_entry.items():
+        for i in region_ids:
+            errors[i] = 'No scaffold with name {}!'.format(entry_name)
+
+    # entries are found through name dicts of the store or index,
+    # then visited in file order, so reads go forward through the file
+    if genome_store is not None:
+        found = {entry_name: genome_store.Find(entry_name, split_space) for entry_name in by_entry}
+        for entry_name, store_entry in sorted((item for item in found.items() if item[1] is not None), key=lambda item: item[1]):
+            region_ids = by_entry[entry_name]
+            fetch = lambda start, end: genome_store.Fetch(store_entry, start, end)
+            CutRegions(regions, region_ids, genome_store.Length(store_entry), fetch, extracted, errors)
+
+    elif fasta_index is not None:
+        found = faidx.FindEntries(fasta_index, fasta_handle, by_entry, split_space)
+        for entry_name, index_entry in sorted(found.items(), key=lambda item: item[1][2]):
+            region_ids = by_entry[entry_name]
+            fetch = lambda start, end: faidx.FetchRegion(fasta_handle, index_entry, start, end)
+            CutRegions(regions, region_ids, index_entry[1], fetch, extracted, errors)
+
+    else:
+        # same-named entries are all cut, so the last one wins
+        for entry_name, seq in ReadEntries(fasta_handle, by_entry, split_space):
+            CutRegions(regions, by_entry[entry_name], len(seq), lambda start, end: seq[start:end], extracted, errors)
+
+    return extracted, errors
+
+def WriteRegions(regions, extracted, errors, output_file, with_strand=False):
+    '''
+        Regions are written in input order, minus strand ones
+        reverse-complemented with with_strand
+    '''
+    for i, region in enumerate(regions):
+        if i in errors:
+            sys.stderr.write('Region {}: {}\n'.format(region[4], errors[i]))
+            continue
+        title = region[4]
+        seq = extracted[i]
+        if with_strand and region[3] == '-':
+            title += '(-)'
+            seq = nucleotides.RevcomDNA(seq)
+        output_file.write('>{}\n{}\n'.format(title, seq))
 
 if __name__ == '__main__':
 
     runArgs = GetOptParser().parse_args(sys.argv[1:])
-    inputSource = sys.stdin
+    inputFile = None
     if runArgs.i is not None:
         if os.path.isfile(runArgs.i):
-            inputSource = open(runArgs.i, 'r')
+            inputFile = runArgs.i
         else:
-            sys.stderr.write('No such file {}.\nExiting with an error!'.format(unArgs.i))
+            sys.stderr.write('No such file {}.\nExiting with an error!'.format(runArgs.i))
             exit()
 
-    outputDest = sys.stdout
-    if runArgs.o is not None:
-        try:
-            outputDest = open(runArgs.o, 'w')
-        except IOError:
-            sys.stderr.writelines('Error: unable to open output file {},\
-            writing to stdout instead\n'.format(runArgs.o))
-            outputDest = sys.stdout
-
     entry_name = None
     cut_from   = 0
     cut_to     = 0
+    regions    = None
 
-    if runArgs.l is not None:
+    if runArgs.b is not None:
+        try:
+            with seqopen.OpenInput(runArgs.b) as region_lines:
+                regions = ParseRegions(region_lines)
+        except IOError:
+            sys.stderr.write('No such file {}.\nExiting with an error!'.format(runArgs.b))
+            exit()
+        except ValueError as err:
+            sys.stderr.write('{}\nExiting with an error!'.format(err))
+            exit()
+
+    elif runArgs.l is not None:
         locus_details = runArgs.l.split(',')
         if len(locus_details) == 1:
             entry_name = locus_details[0]
@@ -86,27 +256,97 @@ if __name__ == '__main__':
         sys.stderr.write('No locus specified!\nExiting with an error!')
         exit()
 
-    split_space = False
-    if runArgs.s is not None:
-        split_space = True
-    fasta_entries = ReadFasta(inputSource, split_space)
+    # names are cut at first space unless --exact, so --s is the default
+    split_space = not runArgs.exact
 
-    selected_locus_seq = None
-    for entry in fasta_entries:
-        if entry[0] == entry_name:
-            selected_locus_seq = entry[1]
+    # .2bit stores are memory-mapped, plain and BGZF files are read
+    # through samtools-compatible .fai index, sequential scan is left
+    # for stdin, plain gzip and irregular line lengths
+    genome_store = None
+    fasta_index = None
+    inputSource = None
+    if inputFile is not None and twobit.IsTwoBit(inputFile):
+        genome_store = twobit.TwoBitFile(inputFile)
+    elif inputFile is not None and (not seqopen.IsGzip(inputFile) or seqopen.IsBgzf(inputFile)):
+        try:
+            fasta_index = faidx.LoadIndex(inputFile)
+            inputSource = seqopen.OpenInput(inputFile, 'rb', random_access=True)
+        except ValueError as err:
+            sys.stderr.write('Can\'t index {}: {}, reading sequentially\n'.format(inputFile, err))
+            fasta_index = None
 
-    if selected_locus_seq is None:
-        sys.stderr.write('No scaffold with name {}!'.format(entry_name))
-        exit()
+    if regions is not None:
+        if genome_store is None and fasta_index is None:
+            extracted, errors = ExtractRegions(regions, split_space, fasta_handle=seqopen.OpenInput(inputFile, 'rb'))
+        else:
+            extracted, errors = ExtractRegions(regions, split_space, genome_store, fasta_index, inputSource)
+
+    elif genome_store is not None:
+        store_entry = genome_store.Find(entry_name, split_space)
+        if store_entry is None:
+            sys.stderr.write('No scaffold with name {}!'.format(entry_name))
+            exit()
+
+        error = CheckLocus(cut_from, cut_to, genome_store.Length(store_entry))
+        if error is not None:
+            sys.stderr.write(error)
+            exit()
+
+        if cut_from == 0 and cut_to == 0:
+            selected_locus_seq = genome_store.Fetch(store_entry)
+        else:
+            selected_locus_seq = genome_store.Fetch(store_entry, cut_from-1, cut_to)
+
+    elif fasta_index is not None:
+        index_entry = faidx.FindEntry(fasta_index, inputSource, entry_name, split_space)
+        if index_entry is None:
+            sys.stderr.write('No scaffold with name {}!'.format(entry_name))
+            exit()
+
+        error = CheckLocus(cut_from, cut_to, index_entry[1])
+        if error is not None:
+            sys.stderr.write(error)
+            exit()
+
+        if cut_from == 0 and cut_to == 0:
+            cut_from, cut_to = 1, index_entry[1]
+        selected_locus_seq = faidx.FetchRegion(inputSource, index_entry, cut_from-1, cut_to)
 
-    if cut_from == 0 and cut_to == 0:
-        outputDest.writelines('>{}\n{}\n'.format(entry_name, selected_locus_seq))
-    elif cut_to >= cut_from and cut_to < len(selected_locus_seq):
-        outputDest.writelines('>{}\n{}\n'.format(entry_name, selected_locus_seq[cut_from-1: cut_to]))
-    elif cut_to >= len(selected_locus_seq):
-        sys.stderr.write('End coordinate {} is out of scaffold\'s length {}!'.format(cut_to, len(selected_locus_seq)))
-        exit()
     else:
-        sys.stderr.write('Can get such locus.\nPlease check --locus key again.')
-        exit()
+        inputSource = seqopen.OpenInput(inputFile, 'rb')
+        selected_locus_seq = ReadFasta(inputSource, entry_name, split_space)
+
+        if selected_locus_seq is None:
+            sys.stderr.write('No scaffold with name {}!'.format(entry_name))
+            exit()
+
+        error = CheckLocus(cut_from, cut_to, len(selected_locus_seq))
+        if error is not None:
+            sys.stderr.write(error)
+            exit()
+
+        if cut_from != 0 or cut_to != 0:
+            selected_locus_seq = selected_locus_seq[cut_from-1: cut_to]
+
+    # output is opened once everything is checked and always closed,
+    # so a BGZF file is never left without its last blocks and EOF marker
+    outputDest = sys.stdout
+    if runArgs.o is not None:
+        try:
+            outputDest = seqopen.OpenOutput(runArgs.o)
+        except IOError:
+            sys.stderr.writelines('Error: unable to open output file {},\
+            writing to stdout instead\n'.format(runArgs.o))
+            outputDest = sys.stdout
+
+    try:
+        if regions is not None:
+            WriteRegions(regions, extracted, errors, outputDest, runArgs.strand)
+        else:
+            outputDest.writelines('>{}\n{}\n'.format(entry_name, selected_locus_seq))
+    finally:
+        if outputDest is not sys.stdout:
+            outputDest.close()
+
+    if regions is not None and len(errors) > 0:
+        sys.stderr.write('{} of {} regions not extracted\n'.format(len(errors), len(regions)))
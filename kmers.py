@@ -0,0 +1,152 @@
+'''
+    K-mer counting on 2-bit encoded sequences
+
+    A record is encoded once (A=0, C=1, G=2, T=3, so k-mer
+    indexes follow alphabetical k-mer order), k-mer indexes of
+    all windows are built with k vectorized shift/or passes and
+    counted with numpy.bincount into a dense 4^k vector.
+    Windows with any non-ACGT base are masked out, lowercase
+    bases count as uppercase.
+
+    Long records are processed in overlapping slices, so memory
+    stays bounded by the slice size. For large k only k-mers
+    present in a record are kept, as sorted (index, count) pairs.
+
+    Codons are in-frame 3-mers: codes are reshaped to rows of
+    three, so coding sequences of whole codons can be joined
+    and counted at once.
+'''
+
+import numpy as np
+
+# byte -> 2-bit code, 4 marks a base that is not A, C, G or T
+BASE_CODE = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(b'ACGT'):
+    BASE_CODE[base] = code
+    BASE_CODE[base + 32] = code
+
+SLICE_SIZE = 2**22
+
+# base-5 codon bin of every ACGT codon, in alphabetical order
+CODON_BINS = np.array([a * 25 + b * 5 + c for a in range(4) for b in range(4) for c in range(4)])
+
+# up to this many k-mers counts are dense vectors
+DENSE_KMERS = 4**8
+
+
+def KmerIndex(kmer):
+    '''
+        Index of k-mer string in alphabetical order
+    '''
+    index = 0
+    for base in kmer.upper():
+        index = index * 4 + 'ACGT'.index(base)
+
+    return index
+
+def KmerStrings(k, indexes=None):
+    '''
+        k-mer strings of indexes (all 4^k when not given),
+        decoded back from 2-bit codes
+    '''
+    if indexes is None:
+        indexes = np.arange(4**k, dtype=np.int64)
+    indexes = np.asarray(indexes, dtype=np.int64)
+    shifts = 2 * np.arange(k - 1, -1, -1, dtype=np.int64)
+    letters = np.frombuffer(b'ACGT', dtype=np.uint8)[(indexes[:, None] >> shifts) & 3]
+
+    return [kmer.decode() for kmer in np.ascontiguousarray(letters).view('S{}'.format(k)).ravel()]
+
+def EncodeSequence(seq):
+    '''
+        uint8 codes of sequence bytes
+    '''
+    return BASE_CODE[np.frombuffer(seq, dtype=np.uint8)]
+
+def KmerIndexes(codes, k):
+    '''
+        k-mer index of every window with only A, C, G, T
+    '''
+    windows = len(codes) - k + 1
+    if windows <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # windows without invalid bases: no change of invalid count inside
+    invalid = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes > 3, out=invalid[1:])
+    valid = invalid[k:] == invalid[:windows]
+
+    indexes = np.zeros(windows, dtype=np.int64)
+    bases = (codes & 3).astype(np.int64)
+    for j in range(k):
+        indexes <<= 2
+        indexes |= bases[j:j + windows]
+
+    return indexes[valid]
+
+def CountKmers(seq, k, counts=None):
+    '''
+        Counts of all 4^k k-mers of sequence bytes,
+        added to counts when given
+    '''
+    if counts is None:
+        counts = np.zeros(4**k, dtype=np.int64)
+
+    codes = EncodeSequence(seq)
+    for start in range(0, max(len(codes) - k + 1, 0), SLICE_SIZE):
+        counts += np.bincount(KmerIndexes(codes[start:start + SLICE_SIZE + k - 1], k), minlength=4**k)
+
+    return counts
+
+def SparseKmers(seq, k):
+    '''
+        Sorted indexes of k-mers present in sequence
+        bytes and their counts
+    '''
+    if 4**k <= DENSE_KMERS:
+        counts = CountKmers(seq, k)
+        indexes = np.flatnonzero(counts)
+        return indexes, counts[indexes]
+
+    codes = EncodeSequence(seq)
+    parts = [np.unique(KmerIndexes(codes[start:start + SLICE_SIZE + k - 1], k), return_counts=True)
+        for start in range(0, max(len(codes) - k + 1, 1), SLICE_SIZE)]
+    if len(parts) == 1:
+        return parts[0]
+
+    indexes, inverse = np.unique(np.concatenate([p[0] for p in parts]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([p[1] for p in parts]))
+
+    return indexes, counts.astype(np.int64)
+
+def CountCodons(seq, counts=None):
+    '''
+        Counts of the 64 codons of sequence bytes read in frame
+        (length a multiple of 3), added to counts when given, and
+        number of codons with bases other than A, C, G, T
+    '''
+    if counts is None:
+        counts = np.zeros(64, dtype=np.int64)
+
+    codes = EncodeSequence(seq)
+    codes = codes[:len(codes) - len(codes) % 3].reshape(-1, 3)
+    # base-5 codon index fits uint8, codons with invalid bases get own bins
+    tally = np.bincount(codes[:, 0] * 25 + codes[:, 1] * 5 + codes[:, 2], minlength=125)
+    counts += tally[CODON_BINS]
+
+    return counts, len(codes) - int(tally[CODON_BINS].sum())
+
+def CountGeneCodons(seq, lengths):
+    '''
+        Codon counts of every gene of sequence bytes holding genes
+        of given lengths in codons back to back, as genes x 64
+        matrix, and number of codons with non-ACGT bases per gene
+    '''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    codes = EncodeSequence(seq)[:3 * lengths.sum()].reshape(-1, 3)
+    genes = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    bins = codes[:, 0] * 25 + codes[:, 1] * 5 + codes[:, 2]
+    tally = np.bincount(genes * 125 + bins, minlength=len(lengths) * 125).reshape(-1, 125)
+    counts = tally[:, CODON_BINS]
+
+    return counts, lengths - counts.sum(axis=1)
@@ -9,20 +9,15 @@
 '''
 
 # Libraries
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import pandas as pd
-from math import pi
-from mpl_toolkits.mplot3d import Axes3D
-import sys, os, argparse, random
+# numpy, pandas and plotting stack are imported where they are used,
+# so --help, input checks and --table-only runs start fast
+import sys, os, argparse, random, multiprocessing
 from collections import defaultdict
 import os.path
-import seaborn as sns
+import countcache, seqopen, seqparse
 
-# for PCA
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
+# largest frequency table (in cells) written as dense .tsv and .npy
+TABLE_DENSE_LIMIT = 2**22
 
 def GetOptParser():
 
@@ -40,96 +35,190 @@ def GetOptParser():
         action='store',
         help="Kmer size in range 2-12 [default: 3]")
 
+    optionParser.add_argument('--j', '--jobs',
+        type=int, default=1,
+        help="Number of worker processes, files and large files' chunks of entries\n\
+        are counted in parallel [default: 1]. Compressed files are one chunk")
+
+    optionParser.add_argument('--cache',
+        action='store',
+        help="Directory of cached k-mer profiles, files counted before (same content,\n\
+        same k) are not counted again")
+
+    optionParser.add_argument('--cache-limit',
+        type=int, default=countcache.DEFAULT_LIMIT,
+        help="Cache size limit in MB, least recently used profiles are removed\n\
+        [default: %(default)s]")
+
+    optionParser.add_argument('--table-only',
+        action='store_true',
+        help="Write k-mer frequencies (<out>_kmers.tsv and <out>_kmers.npy while\n\
+        entries x 4^k is at most {} cells, sparse <out>_kmers.npz otherwise)\n\
+        and PCA coordinates (<out>_PCA.tsv) instead of plots, matplotlib is\n\
+        never loaded".format(TABLE_DENSE_LIMIT))
+
     return optionParser
 
-def GenerateKmerOrder(kmer):
-    kmer_order_dict = {'':''}
-    sorted_kmer_order = []
-    for n in range(kmer):
-        for k in list(kmer_order_dict.keys()):
-            for l in 'AGTC':
-                kmer_order_dict[k+l] = k+ l
-    for i in sorted(kmer_order_dict.keys()):
-        if len(i) == kmer:
-            sorted_kmer_order.append(i)
-    return sorted_kmer_order
-
-
-def ProcessKmersPerEntry(fasta, kmerl, sorted_kmer_order):
-    freqVecs = []
+def ProcessKmersPerEntry(fasta, kmerl, start=None, end=None):
+    '''
+        Sparse k-mer frequency rows of entries with more than one
+        distinct k-mer, in [start, end) byte range of file when set.
+        Rows are packed as (row sizes, k-mer indexes, frequencies)
+        arrays, titles are returned as labels. Indexes follow
+        alphabetical k-mer order (kmers.KmerIndex).
+    '''
+    import numpy as np
+    import kmers
+
+    rowSizes = []
+    indices = []
+    frequencies = []
     freqVecLabels = []
-    countItem = defaultdict(lambda : 0.0)
-    totalItem = 0.0
-    labelItem = ''
-    with open(fasta, 'r') as data_input_file:
-        for line in data_input_file:
-            if line[0] == '>':
-                if len(countItem) > 1:
-                    item_vec = []
-                    for k in sorted_kmer_order:
-                        item_vec.append(countItem[k] / totalItem)
-                    freqVecs.append(item_vec)
-                    freqVecLabels.append(labelItem)
-                countItem = defaultdict(lambda : 0.0)
-                totalItem = 0.0
-                labelItem = line[1:].rstrip()
-
-
-            else:
-                for pos in range(0, len(line.lstrip().rstrip())-kmerl):
-                    countItem[line[pos:pos+kmerl]] += 1
-                    totalItem += 1
-
-    if len(countItem) > 1:
-        item_vec = []
-        for k in sorted_kmer_order:
-            item_vec.append(countItem[k] / totalItem)
-        freqVecs.append(item_vec)
-        freqVecLabels.append(labelItem)
-
-    return freqVecs, freqVecLabels
+    with seqopen.OpenInput(fasta, 'rb') as data_input_file:
+        if start is None:
+            entries = seqparse.ReadFasta(data_input_file)
+        else:
+            entries = seqparse.ParseFasta(seqparse.ReadRange(data_input_file, start, end))
+        for title, seq in entries:
+            indexes, counts = kmers.SparseKmers(seq, kmerl)
+            if len(indexes) > 1:
+                rowSizes.append(len(indexes))
+                indices.append(indexes)
+                frequencies.append(counts / counts.sum())
+                freqVecLabels.append(title.decode())
 
-if __name__ == '__main__':
+    if len(rowSizes) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)), freqVecLabels
 
-    runArgs = GetOptParser().parse_args(sys.argv[1:])
+    return (np.array(rowSizes, dtype=np.int64), np.concatenate(indices), np.concatenate(frequencies)), freqVecLabels
 
-    input_fasta_files = []
-    if runArgs.f is not None:
-        for ffile in runArgs.f:
-            input_fasta_files.append(ffile)
-    else:
-        sys.stderr.write('No input files... Exiting...')
-        exit()
+def ProcessChunk(task):
 
+    return ProcessKmersPerEntry(*task)
 
-    output_file = 'kmer_pca'
-    if runArgs.o is not None:
-        output_file = runArgs.o
+def MergeRows(parts):
+    '''
+        Packed frequency rows of consecutive chunks as one
+    '''
+    import numpy as np
 
+    return tuple(np.concatenate([part[i] for part in parts]) for i in range(3))
 
-    kmer = 3
-    if runArgs.k is not None:
-        kmer = int(runArgs.k)
+def ProcessFiles(input_fasta_files, kmerl, jobs=1, cache=None):
+    '''
+        Packed frequency rows and labels of every file's entries, in
+        input order. Files with a cached profile are not read, with
+        jobs > 1 others are counted by byte-range chunks in a pool.
+    '''
+    import numpy as np
 
-    sorted_kmer_order = GenerateKmerOrder(kmer)
-    kfqTable = pd.DataFrame(columns=['entry', 'color'] + sorted_kmer_order)
-    palette = sns.color_palette(None, len(input_fasta_files))
+    mode = 'kmers{}'.format(kmerl)
+    fileResults = [None] * len(input_fasta_files)
+    if cache is not None:
+        for idx, ff in enumerate(input_fasta_files):
+            entry = cache.Load(ff, mode)
+            if entry is not None:
+                fileResults[idx] = ((entry['row_sizes'], entry['indices'], entry['frequencies']), entry['labels'].tolist())
 
+    tasks = []
+    task_files = []
     for idx, ff in enumerate(input_fasta_files):
-        freqs, labs = ProcessKmersPerEntry(ff, kmer, sorted_kmer_order)
-        for entry, fvector in zip(labs, freqs):
-            kfqRow = {'color' : palette[idx], 'entry' : entry}
-            for k, f in zip(sorted_kmer_order, fvector):
-                kfqRow[k] = f
-            kfqTable = kfqTable.append(kfqRow, ignore_index=True)
-
-
-    frequencyData = kfqTable.loc[:, sorted_kmer_order].values
-    frequencyData = StandardScaler().fit_transform(frequencyData)
-    pca = PCA(n_components=3)
-    pComponents = pca.fit_transform(frequencyData)
+        if fileResults[idx] is None:
+            for start, end in seqparse.FastaChunks(ff, jobs):
+                tasks.append((ff, kmerl, start, end))
+                task_files.append(idx)
+
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap(ProcessChunk, tasks)
+    else:
+        pool = None
+        results = map(ProcessChunk, tasks)
+
+    fileChunks = defaultdict(list)
+    for idx, result in zip(task_files, results):
+        fileChunks[idx].append(result)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    for idx, chunks in fileChunks.items():
+        rows = MergeRows([rows for rows, labs in chunks])
+        labs = [label for rows, labs in chunks for label in labs]
+        fileResults[idx] = (rows, labs)
+        if cache is not None:
+            cache.Store(input_fasta_files[idx], mode, row_sizes=rows[0], indices=rows[1], frequencies=rows[2],
+                labels=np.array(labs, dtype=str))
+
+    freqParts = [rows for rows, labs in fileResults]
+    labels    = [label for rows, labs in fileResults for label in labs]
+    file_ids  = [idx for idx, (rows, labs) in enumerate(fileResults) for label in labs]
+
+    return freqParts, labels, file_ids
+
+def FrequencyMatrix(freqParts, kmerl):
+    '''
+        CSR matrix of packed frequency rows, no dense
+        4^k row is ever built
+    '''
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    rowSizes = np.concatenate([np.zeros(0, dtype=np.int64)] + [sizes for sizes, indices, data in freqParts])
+    indptr = np.zeros(len(rowSizes) + 1, dtype=np.int64)
+    np.cumsum(rowSizes, out=indptr[1:])
+    indices = np.concatenate([np.zeros(0, dtype=np.int64)] + [indices for sizes, indices, data in freqParts])
+    data = np.concatenate([np.zeros(0)] + [data for sizes, indices, data in freqParts])
+
+    return csr_matrix((data, indices, indptr), shape=(len(rowSizes), 4**kmerl))
+
+def ComputePCA(frequencyMatrix, components=3):
+    '''
+        Standardized frequency vectors projected on the first
+        principal components, large tables stay sparse
+    '''
+    import pca
+
+    return pca.SparsePCA(frequencyMatrix, components)
+
+def WriteTables(output_file, kmerl, frequencyMatrix, labels, files, pComponents):
+    '''
+        Frequencies go to .tsv and .npy while the table is at most
+        TABLE_DENSE_LIMIT cells, to sparse .npz otherwise
+    '''
+    import numpy as np
+    import kmers
+    from scipy.sparse import save_npz
+
+    if frequencyMatrix.shape[0] * frequencyMatrix.shape[1] > TABLE_DENSE_LIMIT:
+        save_npz('{}_kmers.npz'.format(output_file), frequencyMatrix)
+    else:
+        freqVecs = frequencyMatrix.toarray()
+        np.save('{}_kmers.npy'.format(output_file), freqVecs)
+
+        with open('{}_kmers.tsv'.format(output_file), 'w') as table_file:
+            table_file.write('\t'.join(['entry', 'file'] + kmers.KmerStrings(kmerl)) + '\n')
+            for entry, ff, fvector in zip(labels, files, freqVecs):
+                table_file.write('\t'.join([entry, ff] + ['{:.6g}'.format(f) for f in fvector]) + '\n')
+
+    with open('{}_PCA.tsv'.format(output_file), 'w') as table_file:
+        table_file.write('entry\tfile\tPC 1\tPC 2\tPC 3\n')
+        for entry, ff, pcs in zip(labels, files, pComponents):
+            table_file.write('\t'.join([entry, ff] + ['{:.6g}'.format(p) for p in pcs]) + '\n')
+
+def PlotPCA(output_file, labels, file_ids, files_count, pComponents):
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import seaborn as sns
+    from mpl_toolkits.mplot3d import Axes3D
+
+    palette = sns.color_palette(None, files_count)
     pDf = pd.DataFrame(data = pComponents, columns = ['PC 1', 'PC 2', 'PC 3'])
-    finalDf = pd.concat([pDf, kfqTable[['color', 'entry']]], axis = 1)
+    labelDf = pd.DataFrame({'color' : [palette[idx] for idx in file_ids], 'entry' : labels, 'file' : file_ids})
+    finalDf = pd.concat([pDf, labelDf], axis = 1)
     print(finalDf)
     plt.clf()
     plt.cla()
@@ -140,11 +229,50 @@ if __name__ == '__main__':
     ax.set_zlabel('Principal Component 3', fontsize = 15)
     ax.set_title('3 component PCA', fontsize = 20)
 
-    for color in palette:
-        indicesToKeep = finalDf['color'] == color
-        ax.scatter(finalDf.loc[indicesToKeep, 'PC 1'], finalDf.loc[indicesToKeep, 'PC 2'], finalDf.loc[indicesToKeep, 'PC 3'],  c = color, s = 90)
+    for idx, color in enumerate(palette):
+        indicesToKeep = finalDf['file'] == idx
+        ax.scatter(finalDf.loc[indicesToKeep, 'PC 1'], finalDf.loc[indicesToKeep, 'PC 2'], finalDf.loc[indicesToKeep, 'PC 3'],  c = [color], s = 90)
     #ax.legend(dataset.keys())
     ax.grid()
     plt.tight_layout()
     plt.savefig('{}_PCA.png'.format(output_file), format='png', dpi=300)
     plt.savefig('{}_PCA.pdf'.format(output_file), format='pdf', dpi=300)
+
+if __name__ == '__main__':
+
+    runArgs = GetOptParser().parse_args(sys.argv[1:])
+
+    input_fasta_files = []
+    if runArgs.f is not None:
+        for ffile in runArgs.f:
+            input_fasta_files.append(ffile)
+    else:
+        sys.stderr.write('No input files... Exiting...')
+        exit()
+
+
+    output_file = 'kmer_pca'
+    if runArgs.o is not None:
+        output_file = runArgs.o
+
+
+    kmer = 3
+    if runArgs.k is not None:
+        kmer = int(runArgs.k)
+
+    cache = None
+    if runArgs.cache is not None:
+        cache = countcache.ProfileCache(runArgs.cache, runArgs.cache_limit)
+
+    freqParts, labels, file_ids = ProcessFiles(input_fasta_files, kmer, max(1, runArgs.j), cache)
+    if cache is not None:
+        cache.Close()
+
+    frequencyMatrix = FrequencyMatrix(freqParts, kmer)
+    del freqParts
+    pComponents = ComputePCA(frequencyMatrix)
+
+    if runArgs.table_only:
+        WriteTables(output_file, kmer, frequencyMatrix, labels, [input_fasta_files[idx] for idx in file_ids], pComponents)
+    else:
+        PlotPCA(output_file, labels, file_ids, len(input_fasta_files), pComponents)
@@ -0,0 +1,167 @@
+'''
+    Multi-pattern search with Aho-Corasick automaton
+
+    The automaton is built once for all patterns and then
+    scans each sequence in a single pass. Transitions are kept
+    for both letter cases, so case-insensitive matching needs
+    no lowercase copy of the sequence.
+
+    Patterns file is either .fasta (title is pattern name) or
+    one pattern per line, optionally as 'name<TAB>pattern'.
+'''
+
+from collections import deque
+from itertools import islice, product
+
+import nucleotides
+
+IUPAC_BASES = {
+'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+'R': 'AG', 'Y': 'CT', 'S': 'GC', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT'
+}
+
+
+def LoadPatterns(patterns_file):
+    '''
+        List of (name, pattern) pairs
+    '''
+    patterns = []
+    with open(patterns_file, 'r') as pattern_lines:
+        fasta_name = None
+        for line in pattern_lines:
+            line = line.rstrip()
+            if len(line) < 1:
+                continue
+            if line[0] == '>':
+                fasta_name = line[1:]
+                patterns.append((fasta_name, ''))
+            elif fasta_name is not None:
+                patterns[-1] = (fasta_name, patterns[-1][1] + line)
+            else:
+                toks = line.split('\t')
+                patterns.append((toks[0], toks[-1]))
+
+    return [(name, pattern) for name, pattern in patterns if len(pattern) > 0]
+
+def ExpandIupac(pattern, max_variants=4096):
+    '''
+        All concrete sequences of a degenerate pattern
+    '''
+    choices = [IUPAC_BASES.get(base, base) for base in pattern.upper()]
+    variants = 1
+    for bases in choices:
+        variants *= len(bases)
+    if variants > max_variants:
+        raise ValueError('Pattern {} expands to {} sequences (limit is {})'.format(pattern, variants, max_variants))
+
+    return [''.join(bases) for bases in product(*choices)]
+
+class PatternAutomaton(object):
+
+    def __init__(self, patterns, ignore_case=True, both_strands=False, iupac=False):
+        '''
+            patterns is a list of (name, pattern) pairs, hits are
+            reported as (start, end, pattern index, strand)
+        '''
+        self.names = [name for name, pattern in patterns]
+        self.max_length = 0
+
+        goto = [{}]
+        out = [[]]
+        for pid, (name, pattern) in enumerate(patterns):
+            variants = ExpandIupac(pattern) if iupac else [pattern]
+            strands = [('+', variants)]
+            if both_strands:
+                strands.append(('-', [nucleotides.RevcomDNA(v, iupac) for v in variants]))
+            for strand, words in strands:
+                for word in set(words):
+                    if ignore_case:
+                        word = word.upper()
+                    state = 0
+                    for ch in word:
+                        if ch not in goto[state]:
+                            goto.append({})
+                            out.append([])
+                            goto[state][ch] = len(goto) - 1
+                        state = goto[state][ch]
+                    if (pid, len(word), strand) not in out[state]:
+                        out[state].append((pid, len(word), strand))
+                    self.max_length = max(self.max_length, len(word))
+
+        # breadth-first pass turns the trie into a full transition
+        # table: every state inherits moves of its failure state
+        self.delta = [None] * len(goto)
+        self.delta[0] = dict(goto[0])
+        queue = deque()
+        for ch, child in goto[0].items():
+            queue.append((child, 0))
+        while queue:
+            state, fail = queue.popleft()
+            self.delta[state] = dict(self.delta[fail])
+            self.delta[state].update(goto[state])
+            out[state] = out[state] + [hit for hit in out[fail] if hit not in out[state]]
+            for ch, child in goto[state].items():
+                queue.append((child, self.delta[fail].get(ch, 0)))
+
+        if ignore_case:
+            for moves in self.delta:
+                for ch in list(moves.keys()):
+                    moves[ch.lower()] = moves[ch]
+
+        self.out = [tuple(hits) for hits in out]
+
+    def Iter(self, text, limit=None):
+        '''
+            Hits as (start, end, pattern index, strand), in order
+            of match end, scanning at most 'limit' characters
+        '''
+        delta = self.delta
+        out = self.out
+        state = 0
+        chars = text if limit is None else islice(text, limit)
+
+        for pos, ch in enumerate(chars):
+            state = delta[state].get(ch, 0)
+            for pid, length, strand in out[state]:
+                yield pos + 1 - length, pos + 1, pid, strand
+
+    def Hits(self, text, limit=None):
+        '''
+            Sorted list of distinct (pattern name, strand) found in text
+        '''
+        found = set((pid, strand) for start, end, pid, strand in self.Iter(text, limit))
+        return [(self.names[pid], strand) for pid, strand in sorted(found)]
+
+    def Leftmost(self, text):
+        '''
+            Start of the leftmost hit or -1, scanning stops as soon as
+            no later hit can start before the best one
+        '''
+        delta = self.delta
+        out = self.out
+        state = 0
+        best = -1
+
+        for pos, ch in enumerate(text):
+            if best >= 0 and pos + 1 - self.max_length >= best:
+                break
+            state = delta[state].get(ch, 0)
+            for pid, length, strand in out[state]:
+                if best < 0 or pos + 1 - length < best:
+                    best = pos + 1 - length
+
+        return best
+
+    def Starts(self, text):
+        '''
+            Starts of non-overlapping hits, leftmost first
+        '''
+        starts = []
+        covered = 0
+        for start, end in sorted((start, end) for start, end, pid, strand in self.Iter(text)):
+            if start >= covered:
+                starts.append(start)
+                covered = end
+
+        return starts
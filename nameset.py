@@ -0,0 +1,206 @@
+'''
+    Compact set of read names
+
+    Names are hashed to 64 bits (FNV-1a over the name bytes,
+    finished with the splitmix64 mixer) in vectorized batches.
+    The set is a sorted numpy array of unique hashes, 8 bytes per
+    name, looked up with binary search; an optional Bloom filter
+    rejects most absent names before the search. Lookups never
+    change the set.
+
+    Two different names share a hash with probability 2^-64, for
+    400M listed and 400M looked up names about 1% chance that a
+    single read is taken as listed.
+'''
+
+import numpy as np
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+# Bloom filter bits per name and probes, about 1% false positives
+BLOOM_BITS = 10
+BLOOM_PROBES = 7
+
+# bytes of name list hashed at once
+NAME_BLOCK = 2**22
+
+# mate suffixes of paired read names
+MATE_SUFFIXES = (b'/1', b'/2')
+
+# SAM FLAG bit of unmapped segment
+SAM_UNMAPPED = 4
+
+# hashes added to Bloom filter at once
+BLOOM_BLOCK = 2**20
+
+
+def HashRanges(codes, starts, ends):
+    '''
+        uint64 hashes of byte ranges [start, end) of uint8 array
+    '''
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(ends, dtype=np.int64) - starts
+    # by length, ranges longer than column are a suffix
+    order = np.argsort(lengths, kind='stable')
+    starts, lengths = starts[order], lengths[order]
+    hashes = np.full(len(starts), FNV_OFFSET, dtype=np.uint64)
+    for column in range(int(lengths[-1]) if len(lengths) else 0):
+        first = np.searchsorted(lengths, column, side='right')
+        active = hashes[first:]
+        active ^= codes[starts[first:] + column]
+        active *= FNV_PRIME
+
+    hashes[order] = hashes.copy()
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xbf58476d1ce4e5b9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94d049bb133111eb)
+    hashes ^= hashes >> np.uint64(31)
+
+    return hashes
+
+def HashNames(names):
+    '''
+        uint64 hashes of a list of names (bytes)
+    '''
+    if len(names) == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ends = np.cumsum([len(name) for name in names])
+    codes = np.frombuffer(b''.join(names), dtype=np.uint8)
+
+    return HashRanges(codes, np.concatenate([[0], ends[:-1]]), ends)
+
+class NameSet(object):
+
+    def __init__(self, hashes, bloom=False):
+
+        # uint64 array is sorted in place, no copy of a large list
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        hashes.sort()
+        if len(hashes) > 1:
+            hashes = hashes[np.concatenate([[True], hashes[1:] != hashes[:-1]])]
+        self.hashes = hashes
+
+        self.bloom = None
+        if bloom and len(hashes) > 0:
+            self.bloom_size = np.uint64(max(64, len(hashes) * BLOOM_BITS))
+            self.bloom = np.zeros(int(self.bloom_size + 7) // 8, dtype=np.uint8)
+            for start in range(0, len(hashes), BLOOM_BLOCK):
+                positions = np.sort(np.concatenate(list(self.BloomPositions(hashes[start:start + BLOOM_BLOCK]))))
+                # bits of one byte are or-ed together, then set at once
+                offsets = positions >> np.uint64(3)
+                bits = np.left_shift(1, (positions & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+                starts = np.flatnonzero(np.concatenate([[True], offsets[1:] != offsets[:-1]]))
+                self.bloom[offsets[starts]] |= np.bitwise_or.reduceat(bits, starts)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @property
+    def nbytes(self):
+        return self.hashes.nbytes + (self.bloom.nbytes if self.bloom is not None else 0)
+
+    def BloomPositions(self, hashes):
+        # double hashing, probe i is h1 + i * h2
+        low = hashes & np.uint64(0xffffffff)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        for i in range(BLOOM_PROBES):
+            yield (low + np.uint64(i) * high) % self.bloom_size
+
+    def Contains(self, hashes):
+        '''
+            Boolean array, True for hashes in the set
+        '''
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.ones(len(hashes), dtype=bool)
+        if self.bloom is not None:
+            for positions in self.BloomPositions(hashes):
+                found &= (self.bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1 == 1
+
+        candidates = np.flatnonzero(found)
+        if len(self.hashes) == 0:
+            found[candidates] = False
+            return found
+        # sorted queries walk the set in order, far fewer cache misses
+        candidates = candidates[np.argsort(hashes[candidates])]
+        slots = np.minimum(np.searchsorted(self.hashes, hashes[candidates]), len(self.hashes) - 1)
+        found[candidates] = self.hashes[slots] == hashes[candidates]
+
+        return found
+
+def StripMates(names):
+    '''
+        Names without /1 or /2 mate suffix
+    '''
+    return [name[:-2] if name[-2:] in MATE_SUFFIXES else name for name in names]
+
+def ReadLines(handle, block_size=NAME_BLOCK):
+    '''
+        Blocks of whole lines of binary handle, without
+        the last line end
+    '''
+    carry = b''
+    for block in iter(lambda: handle.read(block_size), b''):
+        data = carry + block
+        cut = data.rfind(b'\n')
+        if cut < 0:
+            carry = data
+            continue
+        yield data[:cut]
+        carry = data[cut + 1:]
+    if carry:
+        yield carry
+
+def HashLines(data, mates=False):
+    '''
+        Hashes of lines of bytes with trailing whitespace removed
+    '''
+    names = data.split(b'\n')
+    if b' ' in data or b'\t' in data or b'\r' in data:
+        names = [name.rstrip() for name in names]
+    if mates:
+        names = StripMates(names)
+
+    return HashNames(names)
+
+def ReadNameList(handle, mates=False, block_size=NAME_BLOCK):
+    '''
+        Hashes of names of binary list handle, one per line,
+        and number of lines
+    '''
+    hashes = np.concatenate([np.zeros(0, dtype=np.uint64)] +
+        [HashLines(data, mates) for data in ReadLines(handle, block_size)])
+
+    return hashes, len(hashes)
+
+def SamNames(data, unmapped=False):
+    '''
+        Read names of SAM lines of bytes, of mapped
+        (FLAG bit 4 unset) or unmapped records
+    '''
+    names = []
+    for line in data.split(b'\n'):
+        if not line or line[:1] == b'@':
+            continue
+        fields = line.split(b'\t', 2)
+        if len(fields) < 3 or not fields[1].isdigit():
+            raise ValueError('Malformed SAM line {}'.format(line[:80].decode(errors='replace')))
+        if (int(fields[1]) & SAM_UNMAPPED != 0) == unmapped:
+            names.append(fields[0])
+
+    return names
+
+def ReadSamNames(handle, unmapped=False, mates=False, block_size=NAME_BLOCK):
+    '''
+        Hashes of names of mapped (or unmapped) reads of binary
+        SAM handle, one per record, and number of records
+    '''
+    parts = [np.zeros(0, dtype=np.uint64)]
+    for data in ReadLines(handle, block_size):
+        names = SamNames(data, unmapped)
+        parts.append(HashNames(StripMates(names) if mates else names))
+    hashes = np.concatenate(parts)
+
+    return hashes, len(hashes)
@@ -0,0 +1,37 @@
+'''
+    Nucleotide translation tables
+
+    Complement is done with bytes.translate over a full
+    256-entry table and reversed with a slice, so the whole
+    sequence is processed in C at memory bandwidth.
+'''
+
+
+def ComplementTable(pairs, keep=b''):
+    '''
+        Byte table: each base maps to its complement (in both
+        cases), 'keep' bytes map to themselves, everything
+        else becomes N
+    '''
+    table = bytearray(b'N' * 256)
+    for base in keep:
+        table[base] = base
+    for base, complement in pairs:
+        table[ord(base)] = ord(complement)
+        table[ord(base.lower())] = ord(complement.lower())
+
+    return bytes(table)
+
+# A, C, G, T only, as the original defaultdict did (even 'n' becomes 'N')
+STRICT_COMPLEMENT = ComplementTable(zip('ACGT', 'TGCA'))
+
+# full IUPAC: degenerate codes complement to their counterparts,
+# U complements to A, gaps are kept
+IUPAC_COMPLEMENT = ComplementTable(zip('ACGTURYKMSWBVDHN', 'TGCAAYRMKSWVBHDN'), keep=b'-.')
+
+
+def RevcomDNA(dna, iupac=False):
+
+    table = IUPAC_COMPLEMENT if iupac else STRICT_COMPLEMENT
+    # non-ASCII characters become '?', which maps to N
+    return dna.encode('ascii', 'replace').translate(table)[::-1].decode('ascii')
@@ -0,0 +1,137 @@
+'''
+    Principal components of standardized feature tables
+
+    Same projection as StandardScaler + PCA of sklearn (with
+    the signs of its svd_flip), computed with numpy alone, so
+    table-only runs do not pay seconds of sklearn import.
+
+    Tables too large to be dense (e.g. k-mer frequencies for
+    k up to 12) stay sparse: randomized SVD works on column
+    blocks, centering and scaling are applied implicitly, so
+    no dense copy of the table is ever made.
+'''
+
+import numpy as np
+
+# largest table (in cells) that is standardized as dense matrix
+DENSE_LIMIT = 2**26
+
+# columns of sparse table handled at once by RandomizedPCA
+COLUMN_BLOCK = 2**18
+
+
+def Standardize(data):
+    '''
+        Zero mean and unit variance columns,
+        constant columns are only centered
+    '''
+    data = np.asarray(data, dtype=np.float64)
+    data = data - data.mean(axis=0)
+    scale = data.std(axis=0)
+    scale[scale == 0] = 1.0
+
+    return data / scale
+
+def StandardPCA(data, components):
+    '''
+        Rows of data projected on the first principal components
+    '''
+    data = Standardize(data)
+    u, s, vt = np.linalg.svd(data, full_matrices=False)
+    # largest loading of every component is positive
+    signs = np.sign(vt[np.arange(len(vt)), np.argmax(np.abs(vt), axis=1)])
+    signs[signs == 0] = 1.0
+
+    return (u * s * signs)[:, :components]
+
+def ColumnMoments(matrix):
+    '''
+        Column means and standard deviations (1 for
+        constant columns) of sparse CSR or CSC matrix
+    '''
+    rows, columns = matrix.shape
+    if matrix.format == 'csc':
+        column_ids = np.repeat(np.arange(columns), np.diff(matrix.indptr))
+    else:
+        column_ids = matrix.indices
+    mean = np.bincount(column_ids, weights=matrix.data, minlength=columns) / rows
+    square_mean = np.bincount(column_ids, weights=matrix.data * matrix.data, minlength=columns) / rows
+    scale = np.sqrt(np.maximum(square_mean - mean * mean, 0.0))
+    scale[scale == 0] = 1.0
+
+    return mean, scale
+
+def RandomizedPCA(matrix, components, oversamples=10, iterations=4, seed=0):
+    '''
+        Rows of sparse matrix, standardized, projected on the first
+        principal components, by randomized subspace iteration.
+        Standardized column block b is A_b = (X_b - mean_b) / scale_b,
+        products with it are done on the sparse X_b.
+    '''
+    from scipy.sparse import csr_matrix
+
+    # all-zero columns stay zero when standardized, they add nothing;
+    # dropped before CSC conversion, whose indptr is as long as all columns
+    matrix = matrix.tocsr()
+    used = np.sort(matrix.indices)
+    used = used[np.concatenate([[True], used[1:] != used[:-1]])] if len(used) else used
+    matrix = csr_matrix((matrix.data, np.searchsorted(used, matrix.indices), matrix.indptr),
+        shape=(matrix.shape[0], len(used))).tocsc()
+    rows, columns = matrix.shape
+    mean, scale = ColumnMoments(matrix)
+    rank = min(components + oversamples, rows, max(columns, 1))
+    random = np.random.default_rng(seed)
+
+    blocks = []
+    for start in range(0, columns, COLUMN_BLOCK):
+        end = min(start + COLUMN_BLOCK, columns)
+        blocks.append((matrix[:, start:end], mean[start:end], scale[start:end]))
+    del matrix
+
+    def Product(block, right):
+        # A_b @ right
+        sparse, block_mean, block_scale = block
+        right = right / block_scale[:, None]
+        return sparse @ right - block_mean @ right
+
+    def ProductT(block, left):
+        # A_b.T @ left
+        sparse, block_mean, block_scale = block
+        return (sparse.T @ left - np.outer(block_mean, left.sum(axis=0))) / block_scale[:, None]
+
+    # range of A from a random projection, refined by power iterations
+    sample = sum(Product(block, random.standard_normal((block[0].shape[1], rank))) for block in blocks)
+    basis = np.linalg.qr(sample)[0]
+    for i in range(iterations):
+        basis = np.linalg.qr(sum(Product(block, ProductT(block, basis)) for block in blocks))[0]
+
+    # A ~ basis @ B, singular vectors of B from its small Gram matrix
+    gram = np.zeros((basis.shape[1], basis.shape[1]))
+    for block in blocks:
+        part = ProductT(block, basis)
+        gram += part.T @ part
+    values, vectors = np.linalg.eigh(gram)
+    order = np.argsort(values)[::-1][:components]
+    singular = np.sqrt(np.maximum(values[order], 0.0))
+    vectors = vectors[:, order]
+
+    # largest loading of every component is positive, as in StandardPCA
+    largest = np.zeros(len(order))
+    for block in blocks:
+        loadings = ProductT(block, basis) @ vectors
+        block_largest = loadings[np.argmax(np.abs(loadings), axis=0), np.arange(len(order))]
+        largest = np.where(np.abs(block_largest) > np.abs(largest), block_largest, largest)
+    signs = np.sign(largest)
+    signs[signs == 0] = 1.0
+
+    return basis @ vectors * singular * signs
+
+def SparsePCA(matrix, components):
+    '''
+        StandardPCA of sparse matrix, exact when it is small
+        enough to be dense, randomized otherwise
+    '''
+    if matrix.shape[0] * matrix.shape[1] <= DENSE_LIMIT:
+        return StandardPCA(matrix.toarray(), components)
+
+    return RandomizedPCA(matrix, components)
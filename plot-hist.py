@@ -5,15 +5,22 @@
 
     Plot histogram of incoming list of values
 
-    Current version uses Seaborn package
+    Plot is drawn from bin counts only (kernel density by FFT
+    of a binned grid, box from quartiles), so its cost does not
+    depend on number of values
 '''
 
 import sys, os, argparse
-import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
+import seqopen, seqparse
+
+# numpy and plotting stack are imported after arguments are
+# checked, so --help and --table-only runs start fast
+
+# bytes of input parsed into one numpy array
+VALUE_BLOCK = 2**22
+
+# bins of the grid kernel density is computed on
+KDE_GRID = 2**10
 
 def GetOptParser():
 
@@ -25,46 +32,248 @@ def GetOptParser():
 
     optionParser.add_argument('--o', '--out',
         action='store',
-        help="Output .fasta file name (or stdout if not set)")
+        help="Output image file name (with --table-only: histogram .tsv, or stdout if not set)")
+
+    optionParser.add_argument('--stream',
+        action='store_true',
+        help="Constant memory: quartiles come from a KLL sketch, histogram counts\n\
+        from a second pass over input file (or from the sketch for stdin)")
+
+    optionParser.add_argument('--table-only',
+        action='store_true',
+        help="Write histogram bins and counts as tsv instead of plotting,\n\
+        matplotlib is never loaded")
 
     return optionParser
 
+def HistogramBins(values):
+    '''
+        Number of bins seaborn distplot uses: Freedman-Diaconis
+        rule, at most 50 bins
+    '''
+    import numpy as np
 
-if __name__ == '__main__':
+    if len(values) < 2:
+        return 1
+    iqr = np.subtract(*np.percentile(values, [75, 25]))
+    width = 2 * iqr / len(values) ** (1.0 / 3)
+    if width == 0:
+        return int(np.sqrt(len(values)))
 
-    runArgs = GetOptParser().parse_args(sys.argv[1:])
-    inputSource = sys.stdin
-    if runArgs.i is not None:
-        if os.path.isfile(runArgs.i):
-            inputSource = open(runArgs.i, 'r')
-        else:
-            sys.stderr.write('No such file {}.\nExiting with an error!'.format(unArgs.i))
-            exit()
+    return min(int(np.ceil((np.max(values) - np.min(values)) / width)), 50)
 
-    outputDest = None
-    if runArgs.o is not None:
-        outputDest = runArgs.o
+def ReadValues(input_handle, block_size=VALUE_BLOCK):
+    '''
+        Values of binary input, one numpy array per block of lines
+    '''
+    import numpy as np
+
+    carry = b''
+    for block in seqparse.ReadBlocks(input_handle, block_size):
+        data = carry + block
+        cut = data.rfind(b'\n') + 1
+        carry = data[cut:]
+        if cut > 0:
+            yield np.array(data[:cut].split(), dtype=np.float64)
+    if carry.strip():
+        yield np.array(carry.split(), dtype=np.float64)
+
+def OutlierBounds(q25, q75):
+    '''
+        Values strictly within are kept
+    '''
+    iqr = q75 - q25
+    return q25 - 1.5*iqr, q75 + 1.5*iqr
+
+def SketchHistogram(values_sketch):
+    '''
+        Bin edges of values within outlier bounds, as HistogramBins
+        would choose them, and quartiles of those values, from the
+        sketch. Bins span the bounds clipped to data range.
+    '''
+    import numpy as np
+
+    lower, upper = OutlierBounds(*values_sketch.Quantile([0.25, 0.75]))
+    # kept values as a range of ranks
+    low_rank, high_rank = values_sketch.Rank([lower, upper]) / max(len(values_sketch), 1)
+    kept = (high_rank - low_rank) * len(values_sketch)
+    quartiles = values_sketch.Quantile(low_rank + (high_rank - low_rank) * np.array([0.25, 0.5, 0.75]))
+
+    start = max(lower, values_sketch.minimum)
+    end = min(upper, values_sketch.maximum)
+    width = 2 * (quartiles[2] - quartiles[0]) / max(kept, 1) ** (1.0 / 3)
+    if kept < 2:
+        bins = 1
+    elif width == 0:
+        bins = int(np.sqrt(kept))
     else:
-        sys.stderr.write('No output file specified.\nExiting with an error!')
-        exit()
+        bins = min(int(np.ceil((end - start) / width)), 50)
+
+    return np.linspace(start, end, max(bins, 1) + 1), (lower, upper), quartiles
+
+def BoxStats(q25, median, q75, whislo, whishi):
+    '''
+        Box for Axes.bxp, fliers are never drawn
+    '''
+    return {'q1': q25, 'med': median, 'q3': q75, 'whislo': whislo, 'whishi': whishi, 'fliers': []}
+
+def Histogram(values):
+    '''
+        Bin edges and counts, kernel density grid edges and counts,
+        and box statistics of values
+    '''
+    import numpy as np
 
+    counts, edges = np.histogram(values, bins=HistogramBins(values))
+    grid_counts, grid_edges = np.histogram(values, bins=KDE_GRID)
 
-    data_values = []
-    for line in inputSource:
-        data_values.append(float(line.rstrip()))
+    q25, median, q75 = np.percentile(values, [25, 50, 75])
+    iqr = q75 - q25
+    # whiskers end at the most extreme values within 1.5 IQR
+    box = BoxStats(q25, median, q75, values[values >= q25 - 1.5*iqr].min(), values[values <= q75 + 1.5*iqr].max())
+
+    return edges, counts, grid_edges, grid_counts, box
+
+def StreamHistogram(input_path=None):
+    '''
+        Histogram of values within outlier bounds as Histogram gives
+        it, in constant memory. Input file is read twice, second pass
+        counts exactly; stdin is read once and counts are estimated
+        from the sketch. Box whiskers are clipped to the bins.
+    '''
+    import numpy as np
+    import sketch
+
+    values_sketch = sketch.KllSketch()
+    with seqopen.OpenInput(input_path, 'rb') as input_handle:
+        for values in ReadValues(input_handle):
+            values_sketch.Update(values)
+
+    edges, (lower, upper), quartiles = SketchHistogram(values_sketch)
+    grid_edges = np.linspace(edges[0], edges[-1], KDE_GRID + 1)
+
+    counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    grid_counts = np.zeros(KDE_GRID, dtype=np.int64)
+    if input_path is not None:
+        with seqopen.OpenInput(input_path, 'rb') as input_handle:
+            for values in ReadValues(input_handle):
+                values = values[(values > lower) & (values < upper)]
+                counts += np.histogram(values, bins=edges)[0]
+                grid_counts += np.histogram(values, bins=grid_edges)[0]
+    else:
+        items, weights = values_sketch.Items()
+        kept = (items > lower) & (items < upper)
+        weights = weights * len(values_sketch) / weights.sum()
+        counts = np.round(np.histogram(items[kept], bins=edges, weights=weights[kept])[0]).astype(np.int64)
+        grid_counts = np.histogram(items[kept], bins=grid_edges, weights=weights[kept])[0]
 
-    q25 = np.quantile(data_values, 0.25)
-    q75 = np.quantile(data_values, 0.75)
+    q25, median, q75 = quartiles
     iqr = q75 - q25
+    box = BoxStats(q25, median, q75, max(q25 - 1.5*iqr, edges[0]), min(q75 + 1.5*iqr, edges[-1]))
 
-    filtered_data = [x for x in data_values if (x > q25 - 1.5*iqr) and (x < q75 + 1.5*iqr)]
+    return edges, counts, grid_edges, grid_counts, box
+
+def WriteBins(edges, counts, output_file):
+
+    output_file.write('bin_start\tbin_end\tcount\n')
+    for start, end, count in zip(edges[:-1], edges[1:], counts):
+        output_file.write('{:.6g}\t{:.6g}\t{}\n'.format(start, end, count))
+
+def BinnedKde(grid_edges, grid_counts):
+    '''
+        Gaussian kernel density (Scott's bandwidth) of binned values,
+        the grid convolved with the kernel by FFT. Cost depends on
+        grid size only. Density is evaluated at bin centers, up to
+        3 bandwidths beyond the grid as seaborn does.
+    '''
+    import numpy as np
+
+    grid_counts = np.asarray(grid_counts, dtype=np.float64)
+    n = grid_counts.sum()
+    step = grid_edges[1] - grid_edges[0]
+    centers = (grid_edges[:-1] + grid_edges[1:]) / 2
+    if n < 2 or step <= 0:
+        return centers, np.zeros(len(centers))
+    mean = (centers * grid_counts).sum() / n
+    std = np.sqrt(((centers - mean) ** 2 * grid_counts).sum() / (n - 1))
+    bandwidth = std * n ** (-1.0 / 5)
+    if bandwidth <= 0:
+        return centers, np.zeros(len(centers))
+
+    # kernel reaches 4 bandwidths, the curve is drawn to 3
+    half = min(int(np.ceil(4 * bandwidth / step)), 4 * len(grid_counts))
+    offsets = np.arange(-half, half + 1) * step
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+
+    padded = np.concatenate([np.zeros(half), grid_counts, np.zeros(half)])
+    size = 1 << int(len(padded) + len(kernel) - 1).bit_length()
+    density = np.fft.irfft(np.fft.rfft(padded, size) * np.fft.rfft(kernel, size), size)
+    density = np.maximum(density[half:half + len(padded)], 0.0) / n
+    x = grid_edges[0] + (np.arange(len(padded)) - half + 0.5) * step
+
+    shown = (x >= grid_edges[0] - 3 * bandwidth) & (x <= grid_edges[-1] + 3 * bandwidth)
+    return x[shown], density[shown]
+
+def PlotHistogram(edges, counts, grid_edges, grid_counts, box, output_file):
+    '''
+        Density histogram with kernel density and box above, drawn
+        from bin counts and box statistics only
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
     f, (ax_box, ax_hist) = plt.subplots(2, sharex=True,
                                     gridspec_kw={"height_ratios": (.05, .95)})
 
-    sns.boxplot(filtered_data, ax=ax_box)
-    sns.distplot(filtered_data, ax=ax_hist)
+    color = sns.color_palette()[0]
+    ax_box.bxp([box], orientation='horizontal', widths=0.8, showfliers=False, patch_artist=True,
+        boxprops={'facecolor': color}, medianprops={'color': '0.25'})
+    if counts.sum() > 0:
+        ax_hist.hist(edges[:-1], bins=edges, weights=counts, density=True, color=color, alpha=0.4)
+        ax_hist.plot(*BinnedKde(grid_edges, grid_counts), color=color)
     ax_box.set(yticks=[])
     sns.despine(ax=ax_hist)
     sns.despine(ax=ax_box, left=True)
-    plt.savefig(outputDest, dpi=200)
+    plt.savefig(output_file, dpi=200)
+
+
+if __name__ == '__main__':
+
+    runArgs = GetOptParser().parse_args(sys.argv[1:])
+    if runArgs.i is not None and not os.path.isfile(runArgs.i):
+        sys.stderr.write('No such file {}.\nExiting with an error!'.format(runArgs.i))
+        exit()
+
+    outputDest = None
+    if runArgs.o is not None:
+        outputDest = runArgs.o
+    elif not runArgs.table_only:
+        sys.stderr.write('No output file specified.\nExiting with an error!')
+        exit()
+
+    import numpy as np
+
+    if runArgs.stream:
+        histogram = StreamHistogram(runArgs.i)
+    else:
+        with seqopen.OpenInput(runArgs.i, 'rb') as inputSource:
+            data_values = np.concatenate([np.zeros(0)] + list(ReadValues(inputSource)))
+
+        q25 = np.quantile(data_values, 0.25)
+        q75 = np.quantile(data_values, 0.75)
+        lower, upper = OutlierBounds(q25, q75)
+
+        filtered_data = data_values[(data_values > lower) & (data_values < upper)]
+        del data_values
+        histogram = Histogram(filtered_data)
+
+    if runArgs.table_only:
+        if outputDest is None:
+            WriteBins(histogram[0], histogram[1], sys.stdout)
+        else:
+            with seqopen.OpenOutput(outputDest) as output_file:
+                WriteBins(histogram[0], histogram[1], output_file)
+    else:
+        PlotHistogram(*histogram, output_file=outputDest)
@@ -1,22 +1,38 @@
 # This script plots codon usage as radar plot
 
 # Libraries
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import pandas as pd
+# numpy, pandas and plotting stack are imported where they are used,
+# so --help, input checks and --table-only runs start fast
 from math import pi
-import sys, os, argparse, random
-from collections import defaultdict
+import sys, os, argparse, random, multiprocessing
 import os.path
-import seaborn as sns
+import countcache, seqopen, seqparse
 
-# for PCA
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
+# cache modes of species and per-gene codon counts,
+# bump when their layout changes
+CODON_PROFILE = 'codons2'
+GENE_PROFILE = 'genecodons1'
 
+# savefig formats of matplotlib's standard backends, listed here
+# so arguments are checked without loading matplotlib
+FIGURE_FORMATS = ('eps', 'jpeg', 'jpg', 'pdf', 'pgf', 'png', 'ps', 'raw', 'rgba',
+    'svg', 'svgz', 'tif', 'tiff', 'webp')
 
 
+def FigureFormats(value):
+    '''
+        List of formats of comma-separated --formats value
+    '''
+    formats = [fileFormat.strip().lower() for fileFormat in value.split(',') if fileFormat.strip()]
+    unknown = [fileFormat for fileFormat in formats if fileFormat not in FIGURE_FORMATS]
+    if len(formats) == 0:
+        raise argparse.ArgumentTypeError('no figure format given')
+    if len(unknown) > 0:
+        raise argparse.ArgumentTypeError('unsupported figure format {} (choose from {})'.format(
+            ', '.join(unknown), ', '.join(FIGURE_FORMATS)))
+
+    return formats
+
 def GetOptParser():
 
     optionParser = argparse.ArgumentParser()
@@ -29,84 +45,331 @@ def GetOptParser():
         action='store',
         help="Output in png format")
 
-    return optionParser
+    optionParser.add_argument('--j', '--jobs',
+        type=int, default=1,
+        help="Number of worker processes, species' CDS files and their chunks\n\
+        are counted, and figures rendered, in parallel [default: 1].\n\
+        Compressed files are one chunk")
 
+    optionParser.add_argument('--cache',
+        action='store',
+        help="Directory of cached codon counts, CDS files counted before (same\n\
+        content) are not counted again")
+
+    optionParser.add_argument('--cache-limit',
+        type=int, default=countcache.DEFAULT_LIMIT,
+        help="Cache size limit in MB, least recently used counts are removed\n\
+        [default: %(default)s]")
+
+    optionParser.add_argument('--genes',
+        action='store_true',
+        help="Count codons per gene and write the genes x 64 count matrix\n\
+        (<out>_genes.npy), RSCU (<out>_genes_rscu.npy) and per-gene ENC and GC3\n\
+        (<out>_genes.tsv), species tables and plots are sums of the matrix")
+
+    optionParser.add_argument('--gene-format',
+        choices=['npy', 'parquet'], default='npy',
+        help="Per-gene output format, 'parquet' writes one <out>_genes.parquet\n\
+        table and requires pyarrow [default: npy]")
+
+    optionParser.add_argument('--family-species',
+        action='append',
+        help="Species shown on Ser, Leu and Arg codon family radars, can be\n\
+        repeated [default: all species]")
+
+    optionParser.add_argument('--formats',
+        type=FigureFormats, default='png,pdf',
+        help="Comma-separated figure formats [default: png,pdf]")
+
+    optionParser.add_argument('--dpi',
+        type=int, default=300,
+        help="Figure resolution [default: 300]")
+
+    optionParser.add_argument('--table-only',
+        action='store_true',
+        help="Write codon usage (<out>_codons.tsv, <out>_codons.npy) and PCA\n\
+        coordinates (<out>_PCA.tsv) instead of plots, matplotlib is never loaded")
 
-if __name__ == '__main__':
+    return optionParser
 
-    runArgs = GetOptParser().parse_args(sys.argv[1:])
-    speciesListFile = None
-    if runArgs.sl is not None:
-        if os.path.isfile(runArgs.sl):
-            speciesListFile = runArgs.sl
+
+def CdsBatches(cds_file, start=None, end=None):
+    '''
+        CDS of the file, or of its [start, end) byte range, in
+        batches of about SLICE_SIZE bases: titles, sequences joined,
+        lengths in codons and number of CDS ignored since previous
+        batch because their length is not a multiple of 3. Whole
+        codons are joined, so the reading frame is kept.
+    '''
+    import kmers
+
+    titles = []
+    batch = []
+    lengths = []
+    batchSize = 0
+    ignoredCds = 0
+    with seqopen.OpenInput(cds_file, 'rb') as inputCdsFile:
+        if start is None:
+            entries = seqparse.ReadFasta(inputCdsFile)
         else:
-            sys.stderr.write('Wrong species list file or species list file not set!')
-            exit()
+            entries = seqparse.ParseFasta(seqparse.ReadRange(inputCdsFile, start, end))
+        for title, seq in entries:
+            if len(seq) % 3 != 0:
+                ignoredCds += 1
+                continue
+            titles.append(title)
+            batch.append(seq)
+            lengths.append(len(seq) // 3)
+            batchSize += len(seq)
+            if batchSize >= kmers.SLICE_SIZE:
+                yield titles, b''.join(batch), lengths, ignoredCds
+                titles, batch, lengths = [], [], []
+                batchSize = 0
+                ignoredCds = 0
+    yield titles, b''.join(batch), lengths, ignoredCds
+
+def CountCodonUsage(cds_file, codons, start=None, end=None):
+    '''
+        Codon counts (in order of codons) over all CDS of the file,
+        or of its [start, end) byte range, number of codons with
+        non-ACGT bases and number of ignored CDS
+    '''
+    import numpy as np
+    import kmers
+
+    counts = np.zeros(64, dtype=np.int64)
+    invalidCodons = 0
+    ignoredCds = 0
+    for titles, batch, lengths, ignored in CdsBatches(cds_file, start, end):
+        invalidCodons += kmers.CountCodons(batch, counts)[1]
+        ignoredCds += ignored
+
+    return counts[[kmers.KmerIndex(codon) for codon in codons]], invalidCodons, ignoredCds
+
+def CountGeneCodons(cds_file, codons, start=None, end=None):
+    '''
+        Gene titles, genes x codons count matrix, number of codons
+        with non-ACGT bases per gene and number of ignored CDS, for
+        all CDS of the file or of its [start, end) byte range
+    '''
+    import numpy as np
+    import kmers
+
+    geneTitles = []
+    counts = [np.zeros((0, 64), dtype=np.int32)]
+    invalidCodons = [np.zeros(0, dtype=np.int32)]
+    ignoredCds = 0
+    for titles, batch, lengths, ignored in CdsBatches(cds_file, start, end):
+        batchCounts, batchInvalid = kmers.CountGeneCodons(batch, lengths)
+        geneTitles.extend(title.decode() for title in titles)
+        counts.append(batchCounts.astype(np.int32))
+        invalidCodons.append(batchInvalid.astype(np.int32))
+        ignoredCds += ignored
+
+    order = [kmers.KmerIndex(codon) for codon in codons]
+    return geneTitles, np.concatenate(counts)[:, order], np.concatenate(invalidCodons), ignoredCds
+
+def CountChunk(task):
+
+    return CountCodonUsage(*task)
+
+def CountGeneChunk(task):
+
+    return CountGeneCodons(*task)
+
+def MapChunks(function, species_files, codons, jobs=1, counted=()):
+    '''
+        (species index, result) of function over every file not in
+        counted, in input order. With jobs > 1 files and byte-range
+        chunks of each file are processed in a pool.
+    '''
+    tasks = []
+    task_species = []
+    for idx, cds_file in enumerate(species_files):
+        if idx not in counted:
+            for start, end in seqparse.FastaChunks(cds_file, jobs):
+                tasks.append((cds_file, codons, start, end))
+                task_species.append(idx)
+
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap(function, tasks)
+    else:
+        pool = None
+        results = map(function, tasks)
+
+    for idx, result in zip(task_species, results):
+        yield idx, result
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def CountSpecies(species_files, codons, jobs=1, cache=None):
+    '''
+        Codon counts, non-ACGT codon counts and ignored CDS counts
+        per species, in input order. Files with cached counts are
+        not read.
+    '''
+    import numpy as np
+
+    counts  = [None] * len(species_files)
+    invalid = [0] * len(species_files)
+    ignored = [0] * len(species_files)
+    if cache is not None:
+        for idx, cds_file in enumerate(species_files):
+            entry = cache.Load(cds_file, CODON_PROFILE)
+            if entry is not None:
+                counts[idx] = entry['counts']
+                invalid[idx] = int(entry['invalid'])
+                ignored[idx] = int(entry['ignored'])
+
+    counted = set(idx for idx, speciesCounts in enumerate(counts) if speciesCounts is not None)
+    for idx, (chunkCounts, chunkInvalid, chunkIgnored) in MapChunks(CountChunk, species_files, codons, jobs, counted):
+        if counts[idx] is None:
+            counts[idx] = np.zeros(len(codons), dtype=np.int64)
+        counts[idx] += chunkCounts
+        invalid[idx] += chunkInvalid
+        ignored[idx] += chunkIgnored
+
+    if cache is not None:
+        for idx in range(len(species_files)):
+            if idx not in counted:
+                cache.Store(species_files[idx], CODON_PROFILE, counts=counts[idx], invalid=invalid[idx], ignored=ignored[idx])
+
+    return counts, invalid, ignored
+
+def CountGenes(species_files, codons, jobs=1, cache=None):
+    '''
+        Per species [gene titles, genes x codons count matrix,
+        non-ACGT codons per gene, ignored CDS count], in input
+        order. Files with cached matrices are not read.
+    '''
+    import numpy as np
+
+    genes = [None] * len(species_files)
+    if cache is not None:
+        for idx, cds_file in enumerate(species_files):
+            entry = cache.Load(cds_file, GENE_PROFILE)
+            if entry is not None:
+                genes[idx] = [entry['titles'].tolist(), entry['counts'], entry['invalid'], int(entry['ignored'])]
+
+    counted = set(idx for idx, speciesGenes in enumerate(genes) if speciesGenes is not None)
+    chunks = dict((idx, []) for idx in range(len(species_files)) if idx not in counted)
+    for idx, result in MapChunks(CountGeneChunk, species_files, codons, jobs, counted):
+        chunks[idx].append(result)
+
+    for idx, results in chunks.items():
+        genes[idx] = [[title for result in results for title in result[0]],
+            np.concatenate([result[1] for result in results]),
+            np.concatenate([result[2] for result in results]),
+            sum(result[3] for result in results)]
+        if cache is not None:
+            titles, counts, invalid, ignored = genes[idx]
+            cache.Store(species_files[idx], GENE_PROFILE, titles=np.array(titles, dtype=str),
+                counts=counts, invalid=invalid, ignored=ignored)
+
+    return genes
+
+def WriteGeneTables(outputPrefix, species_names, codons, genes, fileFormat='npy'):
+    '''
+        Per-gene counts, RSCU, ENC and GC3 of all species, rows in
+        input order. NPY matrices can be opened with mmap_mode.
+        Statistics are computed one species at a time.
+    '''
+    import numpy as np
+    import codonstats
+
+    rows = sum(len(speciesGenes[0]) for speciesGenes in genes)
+    if fileFormat == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+
+        schema = pyarrow.schema([('species', pyarrow.string()), ('gene', pyarrow.string()),
+            ('codons', pyarrow.int64()), ('non_acgt', pyarrow.int32()),
+            ('ENC', pyarrow.float64()), ('GC3', pyarrow.float64())] +
+            [(codon, pyarrow.int32()) for codon in codons] +
+            [('RSCU_' + codon, pyarrow.float32()) for codon in codons])
+        writer = pyarrow.parquet.ParquetWriter('{}_genes.parquet'.format(outputPrefix), schema)
+    else:
+        np.save('{}_genes.npy'.format(outputPrefix),
+            np.concatenate([np.zeros((0, len(codons)), dtype=np.int32)] + [speciesGenes[1] for speciesGenes in genes]))
+        rscuFile = np.lib.format.open_memmap('{}_genes_rscu.npy'.format(outputPrefix), mode='w+',
+            dtype=np.float32, shape=(rows, len(codons)))
+        tableFile = open('{}_genes.tsv'.format(outputPrefix), 'w')
+        tableFile.write('species\tgene\tcodons\tnon_acgt\tENC\tGC3\n')
+
+    row = 0
+    for species, (titles, counts, invalid, ignored) in zip(species_names, genes):
+        rscu = codonstats.RSCU(counts, codons).astype(np.float32)
+        enc = codonstats.ENC(counts, codons)
+        gc3 = codonstats.GC3(counts, codons)
+        codonTotals = counts.sum(axis=1, dtype=np.int64)
+
+        if fileFormat == 'parquet':
+            columns = [[species] * len(titles), titles, codonTotals, invalid, enc, gc3] + \
+                [counts[:, i] for i in range(len(codons))] + [rscu[:, i] for i in range(len(codons))]
+            writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column) for column in columns], schema=schema))
+        else:
+            rscuFile[row:row + len(titles)] = rscu
+            for title, total, nonAcgt, geneEnc, geneGc3 in zip(titles, codonTotals, invalid, enc, gc3):
+                tableFile.write('{}\t{}\t{}\t{}\t{:.6g}\t{:.6g}\n'.format(species, title, total, nonAcgt, geneEnc, geneGc3))
+        row += len(titles)
 
-    outputPrefix = "CUplot"
-    if runArgs.o is not None:
-        outputPrefix = runArgs.o
-    # read species file
-    # tab-separated line "species \t cds fasta file"
+    if fileFormat == 'parquet':
+        writer.close()
+    else:
+        rscuFile.flush()
+        del rscuFile
+        tableFile.close()
 
-    codonsLeu = ['CTA','CTT','CTG','CTC','TTA','TTG']
-    codonsArg = ['CGA','CGT','CGG','CGC','AGA','AGG']
-    codonsSer = ['TCA','TCT','TCG','TCC','AGC','AGT']
+def ComputePCA(usage, components=2):
 
-    dataset = {}
-    with open(speciesListFile, 'r') as species_file:
-        for line in species_file:
-            toks = line.rstrip().split('\t')
-            if os.path.isfile(toks[1]):
-                dataset[toks[0]] = toks[1]
-            else:
-                print('Can\'t find file {}, skipping'.format(toks[1]))
+    import pca
 
-    # initialize codons
-    codons = []
-    for i in 'AGTC':
-        for j in 'AGTC':
-            for k in 'AGTC':
-                codons.append(i+j+k)
+    return pca.StandardPCA(usage, components)
 
-    cuTable = pd.DataFrame(columns=['species'] + codons)
-    # count codon usage for each species
+def WriteTables(outputPrefix, species_names, codons, usage, pComponents):
 
-    palette = sns.color_palette(None, len(dataset.keys()))
-    palette5 = sns.color_palette(None, 5)
-
-    for species in dataset:
-        print('Counting codon usage table for {}'.format(species))
-        cuSpecies = {'species': species }
-        cu = defaultdict(lambda : 0.0)
-        ct = 0.0
-        cdsEntries = []
-        ignoredCds = 0
-        with open(dataset[species], 'r') as inputCdsFile:
-            for line in inputCdsFile:
-                if line[0] == '>':
-                    cdsEntries.append('')
-                else:
-                    cdsEntries[-1] += line.rstrip().upper()
-        for cds in cdsEntries:
-            if len(cds) % 3 == 0:
-                for p in range(0, len(cds), 3):
-                    ct += 1
-                    cu[cds[p:p+3]] += 1
-            else:
-                ignoredCds += 1
-        for codon in codons:
-            cuSpecies[codon] = cu[codon] / ct
-        cuTable = cuTable.append(cuSpecies, ignore_index=True)
-        print('Ignored CDS: {}'.format(ignoredCds))
+    import numpy as np
 
+    np.save('{}_codons.npy'.format(outputPrefix), np.asarray(usage))
 
-    cuTable.set_index('species', inplace=True)
-    cuTable.sort_values(by=[dataset.keys()[0]],axis=1, ascending=True, inplace=True, kind='quicksort', na_position='last')
-    cuTable.reset_index(inplace=True)
-    print(cuTable)
+    with open('{}_codons.tsv'.format(outputPrefix), 'w') as table_file:
+        table_file.write('\t'.join(['species'] + codons) + '\n')
+        for species, frequencies in zip(species_names, usage):
+            table_file.write('\t'.join([species] + ['{:.6g}'.format(f) for f in frequencies]) + '\n')
+
+    with open('{}_PCA.tsv'.format(outputPrefix), 'w') as table_file:
+        table_file.write('species\tPC 1\tPC 2\n')
+        for species, pcs in zip(species_names, pComponents):
+            table_file.write('\t'.join([species] + ['{:.6g}'.format(p) for p in pcs]) + '\n')
+
+'''
+    Figures
+
+    Every figure is a separate task with its own Agg figure,
+    so they can be rendered in worker processes at once
+'''
+
+CODON_FAMILIES = [('Ser', ['TCA','TCT','TCG','TCC','AGC','AGT']),
+    ('Leu', ['CTA','CTT','CTG','CTC','TTA','TTG']),
+    ('Arg', ['CGA','CGT','CGG','CGC','AGA','AGG'])]
+
+def SaveFigure(plt, figurePrefix, formats, dpi):
+
+    for fileFormat in formats:
+        plt.savefig('{}.{}'.format(figurePrefix, fileFormat), format=fileFormat, dpi=dpi)
+    plt.close('all')
+
+def PlotRadar(figurePrefix, categories, names, values, colors, formats, dpi, fontsize=12, linewidth=1, alpha=1.0, legendsize=None):
+    '''
+        Radar of values (one row per name) over categories
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
 
-    categories = list(cuTable)[1:]
     N = len(categories)
 
     angles = [n / float(N) * 2 * pi for n in range(N)]
@@ -122,92 +385,166 @@ if __name__ == '__main__':
     plt.xticks(angles[:-1], categories)
     for i, label in enumerate(ax.get_xticklabels()):
         label.set_rotation(i*45)
-        label.set_fontsize(12)
-        #label.set_fontproperties('ticks_font')
+        label.set_fontsize(fontsize)
         label.set_horizontalalignment("center")
         label.set_rotation_mode("anchor")
 
 
     ax.set_rlabel_position(0)
-    plt.yticks([1.0/64, 2.0/64], ["1/64", "2/64"], color="black", size=10)
+    plt.yticks([1.0/64, 2.0/64], ["1/64", "2/64"], color="black", size=fontsize - 2)
     plt.ylim(0,0.055)
 
-    for i in range(len(dataset.keys())):
-        values = cuTable.loc[i].drop('species').values.flatten().tolist()
-        values += values[:1]
-        #if i == 0:
-        #    ax.plot(angles, values, linewidth=4, linestyle='solid', color='#87CEFA', label = r"$\it{C. bombi}$")
-        #    ax.fill(angles, values, '#87CEFA', alpha=0.1)
-        #else:
-        ax.plot(angles, values, linewidth=1, linestyle='solid', color=palette[i], label=dataset.keys()[i])
+    for name, row, color in zip(names, values, colors):
+        row = list(row) + list(row[:1])
+        ax.plot(angles, row, linewidth=linewidth, linestyle='solid', color=color, alpha=alpha, label=name)
 
-    plt.legend(loc='upper right', bbox_to_anchor=(0.1, 0.1))
+    plt.legend(loc='upper right', fontsize=legendsize, bbox_to_anchor=(0.1, 0.1))
     plt.tight_layout()
-    plt.savefig('{}_Radar.png'.format(outputPrefix), format='png', dpi=300)
-    plt.savefig('{}_Radar.pdf'.format(outputPrefix), format='pdf', dpi=300)
+    SaveFigure(plt, figurePrefix, formats, dpi)
+
+def PlotPCA(figurePrefix, species_names, pComponents, colors, formats, dpi):
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
 
-    codonData = cuTable.loc[:, codons].values
-    codonData = StandardScaler().fit_transform(codonData)
-    pca = PCA(n_components=2)
-    pComponents = pca.fit_transform(codonData)
-    pDf = pd.DataFrame(data = pComponents, columns = ['PC 1', 'PC 2'])
-    finalDf = pd.concat([pDf, cuTable[['species']]], axis = 1)
-    print(finalDf)
-    plt.clf()
-    plt.cla()
     fig = plt.figure(figsize = (12,12))
     ax = fig.add_subplot(1,1,1)
     ax.set_xlabel('Principal Component 1', fontsize = 15)
     ax.set_ylabel('Principal Component 2', fontsize = 15)
     ax.set_title('2 component PCA', fontsize = 20)
 
-    for target, color in zip(dataset.keys(), palette):
-        indicesToKeep = finalDf['species'] == target
-        ax.scatter(finalDf.loc[indicesToKeep, 'PC 1'], finalDf.loc[indicesToKeep, 'PC 2'], c = color, s = 90)
-    ax.legend(dataset.keys())
+    for pcs, color in zip(pComponents, colors):
+        ax.scatter([pcs[0]], [pcs[1]], c = [color], s = 90)
+    ax.legend(species_names)
     ax.grid()
     plt.tight_layout()
-    plt.savefig('{}_PCA.png'.format(outputPrefix), format='png', dpi=300)
-    plt.savefig('{}_PCA.pdf'.format(outputPrefix), format='pdf', dpi=300)
-
-    #  plot codon family radars
-    for codonsFamily, familyName in zip([codonsSer, codonsLeu, codonsArg], ['Ser', 'Leu', 'Arg']):
-        plt.clf()
-        plt.cla()
-
-        categories = codonsFamily
-        N = len(categories)
-
-        angles = [n / float(N) * 2 * pi for n in range(N)]
-        angles += angles[:1]
-
-        my_dpi=300
-        fig=plt.figure(figsize=(4000/my_dpi, 4000/my_dpi), dpi=my_dpi)
-        ax = plt.subplot(111, polar=True)
-        plt.rcParams["font.family"] = "Times New Roman"
-        ax.set_theta_offset(pi / 2)
-        ax.set_theta_direction(-1)
-
-        plt.xticks(angles[:-1], categories)
-        for i, label in enumerate(ax.get_xticklabels()):
-            label.set_rotation(i*45)
-            label.set_fontsize(22)
-            label.set_horizontalalignment("center")
-            label.set_rotation_mode("anchor")
-
-
-        ax.set_rlabel_position(0)
-        plt.yticks([1.0/64, 2.0/64], ["1/64", "2/64"], color="black", size=20)
-        plt.ylim(0,0.055)
-
-        #for i in range(len(dataset.keys())):
-        for j, i in enumerate(['B.saltans','T.brucei','L.tarentolae','E.monterogeii']):
-            values = cuTable.loc[cuTable['species']==i, codonsFamily].values.flatten().tolist()
-            values += values[:1]
-            #ax.plot(angles, values, linewidth=4, linestyle='solid', color=palette[i], alpha=0.5, label=dataset.keys()[i])
-            ax.plot(angles, values, linewidth=4, linestyle='solid', color=palette5[j], alpha=0.5, label=i)
-
-        plt.legend(loc='upper right', fontsize=32, bbox_to_anchor=(0.1, 0.1))
-        plt.tight_layout()
-        plt.savefig('{}_{}_Radar.png'.format(outputPrefix, familyName), format='png', dpi=300)
-        plt.savefig('{}_{}_Radar.pdf'.format(outputPrefix, familyName), format='pdf', dpi=300)
+    SaveFigure(plt, figurePrefix, formats, dpi)
+
+def RenderFigure(task):
+
+    function, args = task
+    function(*args)
+
+def PlotCodonUsage(outputPrefix, species_names, codons, usage, pComponents, family_species=None,
+        formats=('png', 'pdf'), dpi=300, jobs=1):
+    '''
+        Radar of all codons, PCA and codon family radars, rendered
+        in jobs worker processes. Family radars show family_species
+        (all species when not set).
+    '''
+    import pandas as pd
+    import seaborn as sns
+
+    palette = sns.color_palette(None, len(species_names))
+
+    cuTable = pd.DataFrame(usage, columns=codons)
+    cuTable.insert(0, 'species', species_names)
+    cuTable.set_index('species', inplace=True)
+    cuTable.sort_values(by=[species_names[0]],axis=1, ascending=True, inplace=True, kind='quicksort', na_position='last')
+    cuTable.reset_index(inplace=True)
+    print(cuTable)
+
+    pDf = pd.DataFrame(data = pComponents, columns = ['PC 1', 'PC 2'])
+    print(pd.concat([pDf, cuTable[['species']]], axis = 1))
+
+    if family_species is None:
+        family_species = species_names
+    familyPalette = sns.color_palette(None, len(family_species))
+    familyTable = cuTable.set_index('species').loc[family_species]
+
+    tasks = [(PlotRadar, ('{}_Radar'.format(outputPrefix), list(cuTable)[1:], species_names,
+            cuTable.drop(columns='species').values.tolist(), palette, formats, dpi)),
+        (PlotPCA, ('{}_PCA'.format(outputPrefix), species_names, [list(pcs) for pcs in pComponents], palette, formats, dpi))]
+    for familyName, codonsFamily in CODON_FAMILIES:
+        tasks.append((PlotRadar, ('{}_{}_Radar'.format(outputPrefix, familyName), codonsFamily, family_species,
+            familyTable[codonsFamily].values.tolist(), familyPalette, formats, dpi, 22, 4, 0.5, 32)))
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        pool.map(RenderFigure, tasks)
+        pool.close()
+        pool.join()
+    else:
+        for task in tasks:
+            RenderFigure(task)
+
+if __name__ == '__main__':
+
+    runArgs = GetOptParser().parse_args(sys.argv[1:])
+    if runArgs.genes and runArgs.gene_format == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            sys.stderr.write('--gene-format parquet requires pyarrow.\nExiting with an error!')
+            exit()
+    speciesListFile = None
+    if runArgs.sl is not None:
+        if os.path.isfile(runArgs.sl):
+            speciesListFile = runArgs.sl
+        else:
+            sys.stderr.write('Wrong species list file or species list file not set!')
+            exit()
+
+    outputPrefix = "CUplot"
+    if runArgs.o is not None:
+        outputPrefix = runArgs.o
+    # read species file
+    # tab-separated line "species \t cds fasta file"
+
+    dataset = {}
+    with open(speciesListFile, 'r') as species_file:
+        for line in species_file:
+            toks = line.rstrip().split('\t')
+            if os.path.isfile(toks[1]):
+                dataset[toks[0]] = toks[1]
+            else:
+                print('Can\'t find file {}, skipping'.format(toks[1]))
+
+    # initialize codons
+    codons = []
+    for i in 'AGTC':
+        for j in 'AGTC':
+            for k in 'AGTC':
+                codons.append(i+j+k)
+
+    # count codon usage for each species
+    species_names = list(dataset.keys())
+
+    formats = runArgs.formats
+    family_species = None
+    if runArgs.family_species is not None:
+        family_species = [species for species in runArgs.family_species if species in dataset]
+        for species in runArgs.family_species:
+            if species not in dataset:
+                print('No species {} in species list, skipping it on family radars'.format(species))
+    print('Counting codon usage tables for {}'.format(', '.join(species_names)))
+    cache = None
+    if runArgs.cache is not None:
+        cache = countcache.ProfileCache(runArgs.cache, runArgs.cache_limit)
+
+    species_files = [dataset[species] for species in species_names]
+    if runArgs.genes:
+        genes = CountGenes(species_files, codons, max(1, runArgs.j), cache)
+        WriteGeneTables(outputPrefix, species_names, codons, genes, runArgs.gene_format)
+        # species tables are sums over their genes
+        counts = [speciesGenes[1].sum(axis=0, dtype='int64') for speciesGenes in genes]
+        invalidCodons = [int(speciesGenes[2].sum()) for speciesGenes in genes]
+        ignoredCds = [speciesGenes[3] for speciesGenes in genes]
+    else:
+        counts, invalidCodons, ignoredCds = CountSpecies(species_files, codons, max(1, runArgs.j), cache)
+    if cache is not None:
+        cache.Close()
+    usage = [speciesCounts / float(speciesCounts.sum()) for speciesCounts in counts]
+    for species, invalid, ignored in zip(species_names, invalidCodons, ignoredCds):
+        print('Ignored CDS for {}: {}'.format(species, ignored))
+        if invalid > 0:
+            print('Codons with non-ACGT bases for {}: {}'.format(species, invalid))
+
+    pComponents = ComputePCA(usage)
+
+    if runArgs.table_only:
+        WriteTables(outputPrefix, species_names, codons, usage, pComponents)
+    else:
+        PlotCodonUsage(outputPrefix, species_names, codons, usage, pComponents, family_species,
+            formats, runArgs.dpi, max(1, runArgs.j))
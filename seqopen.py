@@ -0,0 +1,383 @@
+'''
+    Transparent gzip / BGZF input and output
+
+    Input compression is detected by magic bytes, gzip streams
+    are decompressed on a background thread. Output is compressed
+    when file name ends with .gz or .bgz: it is written as BGZF
+    (blocked gzip, readable by zcat and samtools), with blocks
+    compressed in parallel threads.
+
+    BGZF input can be opened for random access with a .gzi
+    index (samtools-compatible, built on first use), so .fai
+    offsets work inside compressed files.
+'''
+
+import sys, os, io, queue, struct, threading, zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# BGZF block holds at most 64 KB, keep data a bit below
+# so even incompressible blocks fit
+BGZF_BLOCK_DATA = 65280
+
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+
+
+def ReadMagic(path):
+
+    with open(path, 'rb') as raw:
+        return raw.read(18)
+
+def IsGzip(path):
+    return ReadMagic(path)[:2] == GZIP_MAGIC
+
+def IsBgzf(path):
+    return BgzfBlockSize(ReadMagic(path)) is not None
+
+def BgzfBlockSize(header):
+    '''
+        Total size of BGZF block from its first 18 bytes,
+        None if it is not a BGZF block header
+    '''
+    if len(header) < 18 or header[:4] != b'\x1f\x8b\x08\x04':
+        return None
+    if header[12:16] != b'BC\x02\x00':
+        return None
+
+    return struct.unpack('<H', header[16:18])[0] + 1
+
+'''
+    Sequential reading
+'''
+
+class ThreadedGzipReader(io.RawIOBase):
+    '''
+        Raw stream of decompressed data, zlib runs on a background
+        thread (it releases the GIL) and hands chunks over a queue
+    '''
+    def __init__(self, raw_handle, read_size=2**20, queue_size=16):
+
+        self.raw_handle = raw_handle
+        self.read_size = read_size
+        self.chunks = queue.Queue(queue_size)
+        self.chunk = b''
+        self.chunk_pos = 0
+        self.finished = False
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self.Decompress)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Decompress(self):
+
+        try:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            in_member = False
+            while not self.stopped:
+                data = self.raw_handle.read(self.read_size)
+                if not data:
+                    break
+                # concatenated members (and BGZF blocks) follow each other
+                while data and not self.stopped:
+                    in_member = True
+                    out = decompressor.decompress(data)
+                    if out:
+                        self.chunks.put(out)
+                    if decompressor.eof:
+                        in_member = False
+                        data = decompressor.unused_data
+                        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                    else:
+                        data = b''
+            if self.stopped:
+                return
+            # damaged input is a ValueError, as malformed records are
+            if in_member:
+                raise ValueError('Compressed file ended before the end-of-stream marker was reached')
+            self.chunks.put(None)
+        except zlib.error as err:
+            if not self.stopped:
+                self.chunks.put(ValueError('Corrupt compressed data: {}'.format(err)))
+        except Exception as err:
+            if not self.stopped:
+                self.chunks.put(err)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+
+        while self.chunk_pos >= len(self.chunk):
+            if self.finished:
+                return 0
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.finished = True
+                return 0
+            if isinstance(chunk, Exception):
+                self.finished = True
+                raise chunk
+            self.chunk = chunk
+            self.chunk_pos = 0
+
+        size = min(len(b), len(self.chunk) - self.chunk_pos)
+        b[:size] = self.chunk[self.chunk_pos:self.chunk_pos + size]
+        self.chunk_pos += size
+
+        return size
+
+    def close(self):
+
+        if self.closed:
+            return
+        # a thread blocked on a full queue is freed by draining it
+        self.stopped = True
+        while self.thread.is_alive():
+            try:
+                while True:
+                    self.chunks.get_nowait()
+            except queue.Empty:
+                pass
+            self.thread.join(0.01)
+        self.raw_handle.close()
+        super(ThreadedGzipReader, self).close()
+
+'''
+    Random access to BGZF
+'''
+
+def GziPath(path):
+    return path + '.gzi'
+
+def BuildGzi(path):
+    '''
+        (compressed offset, uncompressed offset) of every non-empty
+        block, read from block headers and sizes, nothing is decompressed
+    '''
+    blocks = []
+    compressed = 0
+    uncompressed = 0
+
+    with open(path, 'rb') as raw:
+        while True:
+            header = raw.read(18)
+            if len(header) == 0:
+                break
+            block_size = BgzfBlockSize(header)
+            if block_size is None:
+                raise ValueError('{} is not BGZF compressed'.format(path))
+            raw.seek(compressed + block_size - 4)
+            block_data_size = struct.unpack('<I', raw.read(4))[0]
+            # empty blocks (like end-of-file marker) are not indexed
+            if block_data_size > 0 or len(blocks) == 0:
+                blocks.append((compressed, uncompressed))
+            uncompressed += block_data_size
+            compressed += block_size
+
+    return blocks
+
+def WriteGzi(blocks, gzi_path):
+
+    with open(gzi_path, 'wb') as gzi_file:
+        gzi_file.write(struct.pack('<Q', len(blocks) - 1))
+        for block in blocks[1:]:
+            gzi_file.write(struct.pack('<QQ', *block))
+
+def ReadGzi(gzi_path):
+
+    with open(gzi_path, 'rb') as gzi_file:
+        data = gzi_file.read()
+    count = struct.unpack_from('<Q', data, 0)[0]
+
+    return [(0, 0)] + [struct.unpack_from('<QQ', data, 8 + 16 * i) for i in range(count)]
+
+def LoadGzi(path):
+    '''
+        Reuse up-to-date .gzi next to BGZF file or build a new one,
+        saving it when the directory is writable
+    '''
+    gzi_path = GziPath(path)
+    if os.path.isfile(gzi_path) and os.path.getmtime(gzi_path) >= os.path.getmtime(path):
+        return ReadGzi(gzi_path)
+
+    blocks = BuildGzi(path)
+    try:
+        WriteGzi(blocks, gzi_path)
+    except IOError:
+        pass
+
+    return blocks
+
+class BgzfReader(io.RawIOBase):
+    '''
+        Seekable raw stream over uncompressed BGZF data,
+        only the block holding current position is inflated
+    '''
+    def __init__(self, path):
+
+        self.handle = open(path, 'rb')
+        blocks = LoadGzi(path)
+        self.compressed = [c for c, u in blocks]
+        self.uncompressed = [u for c, u in blocks]
+        self.pos = 0
+        self.block_index = -1
+        self.block = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            self.LoadBlock(len(self.compressed) - 1)
+            offset += self.uncompressed[-1] + len(self.block)
+        self.pos = max(0, offset)
+
+        return self.pos
+
+    def LoadBlock(self, i):
+
+        if i == self.block_index:
+            return
+        self.handle.seek(self.compressed[i])
+        header = self.handle.read(18)
+        data = header + self.handle.read(BgzfBlockSize(header) - 18)
+        self.block = zlib.decompress(data[18:-8], -zlib.MAX_WBITS)
+        self.block_index = i
+
+    def readinto(self, b):
+
+        i = bisect_right(self.uncompressed, self.pos) - 1
+        self.LoadBlock(i)
+        offset = self.pos - self.uncompressed[i]
+        if offset >= len(self.block):
+            return 0
+
+        size = min(len(b), len(self.block) - offset)
+        b[:size] = self.block[offset:offset + size]
+        self.pos += size
+
+        return size
+
+    def close(self):
+        self.handle.close()
+        super(BgzfReader, self).close()
+
+'''
+    Compressed output
+'''
+
+def CompressBlock(data, level=6):
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+
+    return header + deflated + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+class BgzfWriter(io.RawIOBase):
+    '''
+        Cuts written data into BGZF blocks and compresses them
+        on a thread pool, blocks are written in order
+    '''
+    def __init__(self, raw_handle, threads=None, level=6):
+
+        self.raw_handle = raw_handle
+        self.level = level
+        self.threads = threads or min(4, os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(self.threads)
+        self.pending = deque()
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+
+        self.data += b
+        while len(self.data) >= BGZF_BLOCK_DATA:
+            self.Submit(bytes(self.data[:BGZF_BLOCK_DATA]))
+            del self.data[:BGZF_BLOCK_DATA]
+
+        return len(b)
+
+    def Submit(self, data):
+
+        self.pending.append(self.pool.submit(CompressBlock, data, self.level))
+        while len(self.pending) > self.threads * 4:
+            self.raw_handle.write(self.pending.popleft().result())
+
+    def close(self):
+
+        if self.closed:
+            return
+        if len(self.data) > 0:
+            self.Submit(bytes(self.data))
+            self.data = bytearray()
+        while self.pending:
+            self.raw_handle.write(self.pending.popleft().result())
+        self.raw_handle.write(BGZF_EOF)
+        self.pool.shutdown()
+        self.raw_handle.close()
+        super(BgzfWriter, self).close()
+
+'''
+    Openers used by scripts
+'''
+
+def OpenInput(path=None, mode='r', random_access=False):
+    '''
+        Open file (or stdin if path is None) for reading,
+        gzip is detected and decompressed transparently.
+        random_access gives a seekable stream, for compressed
+        input it requires BGZF.
+    '''
+    if path is None:
+        handle = sys.stdin.buffer
+    else:
+        handle = open(path, 'rb')
+
+    if handle.peek(2)[:2] == GZIP_MAGIC:
+        if random_access:
+            handle.close()
+            if not IsBgzf(path):
+                raise ValueError('{} is gzip, but not BGZF compressed'.format(path))
+            handle = io.BufferedReader(BgzfReader(path))
+        else:
+            handle = io.BufferedReader(ThreadedGzipReader(handle), 2**20)
+
+    if 'b' in mode:
+        return handle
+
+    return io.TextIOWrapper(handle)
+
+def IsCompressedName(path):
+    return path is not None and path.endswith(COMPRESSED_SUFFIXES)
+
+def OpenOutput(path, mode='w', threads=None):
+    '''
+        Open file for writing, names ending with .gz or .bgz
+        get BGZF compression
+    '''
+    handle = open(path, 'wb')
+    if IsCompressedName(path):
+        handle = io.BufferedWriter(BgzfWriter(handle, threads), 2**20)
+
+    if 'b' in mode:
+        return handle
+
+    return io.TextIOWrapper(handle)
@@ -0,0 +1,284 @@
+'''
+    Bytes-level FASTA / FASTQ parser
+
+    Input is read in large binary blocks. FASTA blocks are cut
+    into records at '>' found with bytes.find, FASTQ blocks are
+    split into lines in one call and grouped by four. Line breaks
+    are removed from a whole record at once, so there is no
+    per-line decoding, stripping or string concatenation.
+    Records are bytes, callers decode only what they use.
+
+    All readers take binary handles, e.g. from seqopen.OpenInput
+    with 'rb' mode.
+
+    FASTQ blocks can also be kept whole: record offsets are found
+    in one numpy pass over line breaks and checked (header '@',
+    '+' line, quality as long as sequence), so records are written
+    back as slices of the block without any per-record objects.
+
+    Uncompressed FASTA files can be split into byte ranges starting
+    at '>' lines, so worker processes parse chunks independently.
+'''
+
+import os
+
+# bump when parsed records may change, cached counts are keyed by it
+PARSER_VERSION = 1
+
+BLOCK_SIZE = 2**20
+
+# FASTQ blocks framed at once by ReadFastqBlocks
+FASTQ_BLOCK_SIZE = 2**22
+
+# whitespace is never part of a sequence
+WHITESPACE = b' \t\r\n\v\f'
+
+
+def ReadBlocks(handle, block_size=BLOCK_SIZE):
+
+    while True:
+        block = handle.read(block_size)
+        if not block:
+            break
+        yield block
+
+def JoinSequence(lines):
+    '''
+        Sequence lines with line breaks (and any other
+        whitespace) removed
+    '''
+    seq = lines.replace(b'\n', b'')
+    if not seq.isalpha():
+        seq = seq.translate(None, WHITESPACE)
+
+    return seq
+
+def SplitRecord(text):
+    '''
+        Title and sequence lines of record text without '>'
+    '''
+    line_end = text.find(b'\n')
+    if line_end < 0:
+        return text.rstrip(), b''
+
+    return text[:line_end].rstrip(), text[line_end+1:]
+
+def SplitBlock(data, line_start):
+    '''
+        Block cut at every '>' starting a line, the first piece
+        continues the record of previous block. line_start tells
+        if the block itself starts at a line start.
+    '''
+    chunks = []
+    pos = 0
+    found = data.find(b'>')
+    while found >= 0:
+        if data[found-1] == 10 if found > 0 else line_start:
+            chunks.append(data[pos:found])
+            pos = found + 1
+        found = data.find(b'>', found + 1)
+    chunks.append(data[pos:])
+
+    return chunks
+
+def ParseFasta(blocks, select=None):
+    '''
+        (title, sequence) of every record in a stream of blocks,
+        title is the '>' line without '>' and trailing whitespace.
+        Records with select(title) false are skipped without
+        building their sequence.
+    '''
+    # pieces of the record continued in next block,
+    # None before the first record
+    pending = None
+    keep = None
+    line_start = True
+
+    for data in blocks:
+        chunks = SplitBlock(data, line_start)
+        line_start = data.endswith(b'\n')
+
+        if pending is not None and keep is not False:
+            pending.append(chunks[0])
+            # sequence of unselected record is dropped as soon as its title is known
+            if keep is None and select is not None and len(chunks) == 1 and b'\n' in chunks[0]:
+                keep = bool(select(SplitRecord(b''.join(pending))[0]))
+                if not keep:
+                    pending = []
+        if len(chunks) == 1:
+            continue
+
+        if pending is not None and keep is not False:
+            title, lines = SplitRecord(b''.join(pending))
+            if keep or select is None or select(title):
+                yield title, JoinSequence(lines)
+
+        # records within the block
+        for i in range(1, len(chunks) - 1):
+            text = chunks[i]
+            line_end = text.find(b'\n')
+            if line_end < 0:
+                line_end = len(text)
+            title = text[:line_end].rstrip()
+            if select is None or select(title):
+                seq = text[line_end+1:].replace(b'\n', b'')
+                if not seq.isalpha():
+                    seq = seq.translate(None, WHITESPACE)
+                yield title, seq
+
+        pending = [chunks[-1]]
+        keep = None
+
+    if pending is not None and keep is not False:
+        title, lines = SplitRecord(b''.join(pending))
+        if keep or select is None or select(title):
+            yield title, JoinSequence(lines)
+
+def ReadFasta(handle, select=None, block_size=BLOCK_SIZE):
+    return ParseFasta(ReadBlocks(handle, block_size), select)
+
+'''
+    Byte-range chunks
+'''
+
+# smallest chunk worth a separate task
+CHUNK_SIZE = 2**20
+
+def SplitFasta(fasta_path, chunks):
+    '''
+        List of (start, end) byte ranges, each starting at '>' line
+    '''
+    size = os.path.getsize(fasta_path)
+    bounds = [0]
+    with open(fasta_path, 'rb') as fasta_handle:
+        for k in range(1, chunks):
+            pos = max(size * k // chunks, bounds[-1])
+            fasta_handle.seek(pos)
+            if pos > 0:
+                # skip to the end of current line
+                pos += len(fasta_handle.readline())
+            while pos < size:
+                line = fasta_handle.readline()
+                if line.startswith(b'>'):
+                    break
+                pos += len(line)
+            if pos < size and pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def FastaChunks(fasta_path, jobs):
+    '''
+        Byte ranges for jobs workers, a few per worker to even out
+        the load and at least CHUNK_SIZE each. Compressed files are
+        one range (None, None), they can only be read from the start.
+    '''
+    with open(fasta_path, 'rb') as fasta_handle:
+        compressed = fasta_handle.read(2) == b'\x1f\x8b'
+    if jobs <= 1 or compressed:
+        return [(None, None)]
+
+    return SplitFasta(fasta_path, max(1, min(jobs * 4, os.path.getsize(fasta_path) // CHUNK_SIZE)))
+
+def ReadRange(handle, start, end, block_size=BLOCK_SIZE):
+    '''
+        Blocks of seekable handle within [start, end)
+    '''
+    handle.seek(start)
+    while start < end:
+        block = handle.read(min(block_size, end - start))
+        if not block:
+            break
+        start += len(block)
+        yield block
+
+def SplitFastq(lines):
+    '''
+        Records of complete 4-line groups
+    '''
+    it = iter(lines)
+    for record in zip(it, it, it, it):
+        if record[0][:1] != b'@' or record[2][:1] != b'+':
+            raise ValueError('Malformed FASTQ record: {}'.format(record[0].decode(errors='replace')))
+        yield record
+
+def ParseFastq(blocks):
+    '''
+        Records of a stream of blocks as (header, sequence, '+' line,
+        quality) lines without line breaks, header keeps its '@'
+    '''
+    carry = b''
+
+    for block in blocks:
+        data = carry + block if carry else block
+        if b'\r' in data:
+            data = data.replace(b'\r\n', b'\n')
+        lines = data.split(b'\n')
+        complete = (len(lines) - 1) // 4 * 4
+        carry = b'\n'.join(lines[complete:])
+        del lines[complete:]
+        yield from SplitFastq(lines)
+
+    # last record may lack final line break, blank lines at the end are ignored
+    lines = carry.strip().split(b'\n') if carry.strip() else []
+    if len(lines) % 4 != 0:
+        raise ValueError('Truncated FASTQ record at the end of input')
+    yield from SplitFastq(lines)
+
+def ReadFastq(handle, block_size=BLOCK_SIZE):
+    return ParseFastq(ReadBlocks(handle, block_size))
+
+def FrameFastq(data, final=False):
+    '''
+        Offsets of whole records at the start of data ending with
+        a line break: record starts with end of the last one, and
+        header line ends. Records that are not '@' header, sequence,
+        '+' line and quality of sequence length raise ValueError.
+    '''
+    import numpy as np
+
+    breaks = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+    if final and len(breaks) % 4 != 0:
+        raise ValueError('Truncated FASTQ record at the end of input')
+    breaks = breaks[:len(breaks) // 4 * 4]
+    line_starts = np.concatenate([[0], breaks[:-1] + 1]) if len(breaks) else breaks
+    line_starts, line_ends = line_starts.reshape(-1, 4), breaks.reshape(-1, 4)
+
+    codes = np.frombuffer(data, dtype=np.uint8)
+    valid = ((codes[line_starts[:, 0]] == ord('@')) & (codes[line_starts[:, 2]] == ord('+')) &
+        (line_ends[:, 1] - line_starts[:, 1] == line_ends[:, 3] - line_starts[:, 3]))
+    if not valid.all():
+        bad = np.flatnonzero(~valid)[0]
+        header = data[line_starts[bad, 0]:line_ends[bad, 0]]
+        raise ValueError('Malformed FASTQ record: {}'.format(header.decode(errors='replace')))
+
+    return np.append(line_starts[:, 0], breaks[-1] + 1 if len(breaks) else 0), line_ends[:, 0]
+
+def ParseFastqBlocks(blocks):
+    '''
+        Blocks of whole records of a stream of blocks as (data,
+        record starts with end, header line ends), see FrameFastq
+    '''
+    carry = b''
+
+    for block in blocks:
+        data = carry + block if carry else block
+        if b'\r' in data:
+            data = data.replace(b'\r\n', b'\n')
+        starts, header_ends = FrameFastq(data)
+        carry = data[starts[-1]:]
+        if len(header_ends):
+            yield data, starts, header_ends
+
+    # last record may lack final line break, blank lines at the end are ignored
+    if carry.strip():
+        data = carry.strip() + b'\n'
+        starts, header_ends = FrameFastq(data, final=True)
+        yield data, starts, header_ends
+
+def ReadFastqBlocks(handle, block_size=FASTQ_BLOCK_SIZE):
+    return ParseFastqBlocks(ReadBlocks(handle, block_size))
+
+def FormatFastq(record):
+    return b'\n'.join(record) + b'\n'
@@ -0,0 +1,111 @@
+'''
+    KLL quantile sketch (Karnin, Lang, Liberty 2016)
+
+    Values are kept in levels of compactors, an item of level h
+    stands for 2^h input values. A level over its capacity is
+    sorted and every other item (random offset) moves one level
+    up, so memory stays O(k) whatever the input size. Values are
+    added as numpy arrays, a whole chunk at a time.
+
+    Sketches of parts of the input can be merged, rank error is
+    about 1.7 / k of the number of values.
+'''
+
+import numpy as np
+
+DEFAULT_K = 2000
+
+
+class KllSketch(object):
+
+    def __init__(self, k=DEFAULT_K, seed=0):
+
+        self.k = k
+        self.levels = [np.zeros(0)]
+        self.count = 0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.random = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.count
+
+    def Capacity(self, level):
+        # levels below the top shrink geometrically
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2.0 / 3) ** depth)), 2)
+
+    def Update(self, values):
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.Compress()
+
+    def Merge(self, other):
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.Compress()
+
+    def Compress(self):
+
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.Capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                items = np.sort(items)
+                # odd item out stays on this level
+                stay = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[self.random.integers(2)::2]])
+                self.levels[level] = stay
+            level += 1
+
+    def Items(self):
+        '''
+            Sorted retained items and their weights
+        '''
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2.0 ** level) for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+
+        return items[order], weights[order]
+
+    def Rank(self, values):
+        '''
+            Estimated number of input values below each value
+        '''
+        items, weights = self.Items()
+        cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+        # retained weight stands for count of values seen
+        cumulative *= self.count / max(cumulative[-1], 1.0)
+
+        return cumulative[np.searchsorted(items, values, side='left')]
+
+    def Quantile(self, q):
+        '''
+            Estimated q-quantiles (array or number), exact at 0 and 1
+        '''
+        items, weights = self.Items()
+        q = np.asarray(q, dtype=np.float64)
+        if len(items) == 0:
+            return np.full(q.shape, np.nan)
+
+        cumulative = np.cumsum(weights)
+        positions = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        result = items[np.minimum(positions, len(items) - 1)]
+        result = np.where(q <= 0, self.minimum, result)
+
+        return np.where(q >= 1, self.maximum, result)
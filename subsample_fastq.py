@@ -3,13 +3,15 @@ import sys, random, os, argparse
 
 from collections import defaultdict
 
+import seqopen, seqparse
+
 def GetOptParser():
 
     optionParser = argparse.ArgumentParser()
 
     optionParser.add_argument('--i', '--fastq1',
         action='store',
-        help="Input FASTQ with SE reads or R1 of PE reads")
+        help="Input FASTQ with SE reads or R1 of PE reads, may be gzip compressed")
 
     optionParser.add_argument('--r', '--fastq2',
         action='store',
@@ -17,7 +19,7 @@ def GetOptParser():
 
     optionParser.add_argument('--o', '--out1',
         action='store',
-        help="Output FASTQ for SE reads or R1 of PE reads")
+        help="Output FASTQ for SE reads or R1 of PE reads, names ending with .gz or .bgz are BGZF compressed")
 
     optionParser.add_argument('--u', '--out2',
         action='store',
@@ -32,46 +34,23 @@ def GetOptParser():
 
 
 def SubsampleReadsPairedEnd(fraq, r1, r2, o1, o2):
-    rf1 = open(r1, 'r').readlines()
-    rf2 = open(r2, 'r').readlines()
-    of1 = open(o1, 'w')
-    of2 = open(o2, 'w')
-
-    i = 0
-    while i < len(rf1):
-        s = random.randint(1, 100)
-        if s <= fraq:
-            of1.writelines(rf1[i])
-            of1.writelines(rf1[i+1])
-            of1.writelines(rf1[i+2])
-            of1.writelines(rf1[i+3])
-
-            of2.writelines(rf2[i])
-            of2.writelines(rf2[i+1])
-            of2.writelines(rf2[i+2])
-            of2.writelines(rf2[i+3])
-        i += 4
-
-    of1.close()
-    of2.close()
-
+    with seqopen.OpenInput(r1, 'rb') as if1, seqopen.OpenInput(r2, 'rb') as if2, \
+        seqopen.OpenOutput(o1, 'wb') as of1, seqopen.OpenOutput(o2, 'wb') as of2:
 
-def SubsampleReadsSingleEnd(fraq, r1, o1):
-    rf1 = open(r1, 'r').readlines()
-    of1 = open(o1, 'w')
+        for read1, read2 in zip(seqparse.ReadFastq(if1), seqparse.ReadFastq(if2)):
+            s = random.randint(1, 100)
+            if s <= fraq:
+                of1.write(seqparse.FormatFastq(read1))
+                of2.write(seqparse.FormatFastq(read2))
 
-    i = 0
-    while i < len(rf1):
-        s = random.randint(1, 100)
-        if s <= fraq:
-            of1.writelines(rf1[i])
-            of1.writelines(rf1[i+1])
-            of1.writelines(rf1[i+2])
-            of1.writelines(rf1[i+3])
 
-        i += 4
+def SubsampleReadsSingleEnd(fraq, r1, o1):
+    with seqopen.OpenInput(r1, 'rb') as if1, seqopen.OpenOutput(o1, 'wb') as of1:
 
-    of1.close()
+        for read1 in seqparse.ReadFastq(if1):
+            s = random.randint(1, 100)
+            if s <= fraq:
+                of1.write(seqparse.FormatFastq(read1))
 
 
 
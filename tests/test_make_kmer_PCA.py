@@ -0,0 +1,43 @@
+'''
+    Smoke test of make_kmer_PCA.py table-only run at k=12:
+    nothing as large as 4^k (not even a byte per k-mer)
+    may be allocated along the way
+'''
+
+import os, sys, random, runpy, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# imported ahead, so their module data is not counted
+import numpy, scipy.sparse, countcache, kmers, pca, seqopen, seqparse
+
+KMER = 12
+
+
+def WriteRandomFasta(path, entries, length):
+
+    generator = random.Random(0)
+    with open(path, 'w') as fasta_file:
+        for i in range(entries):
+            fasta_file.write('>entry{}\n{}\n'.format(i, ''.join(generator.choice('ACGT') for j in range(length))))
+
+def test_k12_builds_nothing_of_4_to_k(tmp_path, monkeypatch):
+
+    fasta = str(tmp_path / 'input.fa')
+    output_file = str(tmp_path / 'out')
+    WriteRandomFasta(fasta, 100, 300)
+    monkeypatch.setattr(sys, 'argv', ['make_kmer_PCA.py', '--f', fasta, '--k', str(KMER), '--table-only', '--o', output_file])
+
+    tracemalloc.start()
+    try:
+        runpy.run_path(os.path.join(ROOT, 'make_kmer_PCA.py'), run_name='__main__')
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < 4**KMER
+    with open(output_file + '_PCA.tsv') as table_file:
+        assert len(table_file.readlines()) == 101
+    assert os.path.exists(output_file + '_kmers.npz')
+    assert not os.path.exists(output_file + '_kmers.tsv')
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+'''
+    UCSC-compatible .2bit genome store
+
+    Bases are packed 4 per byte (T=0, C=1, A=2, G=3), N-runs and
+    soft-masked (lowercase) runs are kept as interval lists.
+    Stores are opened through mmap, so there is no parsing step:
+    only the requested bytes are ever paged in.
+
+    Any non-ACGT base is stored as N.
+
+    run example (one-time conversion):
+    ./twobit.py --i genome.fasta --o genome.2bit
+
+    Coordinates in this module are 0-based, end-exclusive.
+'''
+
+import sys, os, argparse, mmap, re, struct, tempfile, shutil
+from array import array
+from bisect import bisect_right
+
+import seqopen, seqparse
+
+SIGNATURE = 0x1A412743
+
+# base -> 2-bit code, everything else packs as T and is covered by N-runs
+CODE_TABLE = bytes.maketrans(b'TCAG', b'\x00\x01\x02\x03')
+CODE_TABLE = bytes(c if c < 4 else 0 for c in CODE_TABLE)
+
+# four 2-bit codes read as native uint32 -> packed byte
+PACK_TABLE = {}
+for packed in range(256):
+    codes = bytes([(packed >> 6) & 3, (packed >> 4) & 3, (packed >> 2) & 3, packed & 3])
+    PACK_TABLE[int.from_bytes(codes, sys.byteorder)] = packed
+
+# packed byte -> four bases
+UNPACK_TABLE = tuple(bytes(b'TCAG'[(packed >> shift) & 3] for shift in (6, 4, 2, 0)) for packed in range(256))
+
+N_RUN = re.compile(rb'[^ACGTacgt]+')
+MASK_RUN = re.compile(rb'[a-z]+')
+
+
+def GetOptParser():
+
+    optionParser = argparse.ArgumentParser()
+
+    optionParser.add_argument('--i', '--in',
+        action='store',
+        help="Input .fasta file name, may be gzip compressed (or stdin if not set)")
+
+    optionParser.add_argument('--o', '--out',
+        action='store',
+        help="Output .2bit file name")
+
+    return optionParser
+
+def IsTwoBit(path):
+
+    try:
+        with open(path, 'rb') as store_file:
+            head = store_file.read(4)
+    except IOError:
+        return False
+
+    return len(head) == 4 and SIGNATURE in struct.unpack('<I', head) + struct.unpack('>I', head)
+
+'''
+    Conversion
+'''
+
+def PackSequence(seq):
+    '''
+        Pack uppercase bases 4 per byte
+    '''
+    codes = seq.translate(CODE_TABLE)
+    if len(codes) % 4:
+        codes += b'\x00' * (4 - len(codes) % 4)
+
+    return bytes(map(PACK_TABLE.__getitem__, memoryview(codes).cast('I')))
+
+def Runs(pattern, seq):
+
+    starts = array('I')
+    sizes  = array('I')
+    for match in pattern.finditer(seq):
+        starts.append(match.start())
+        sizes.append(match.end() - match.start())
+
+    return starts, sizes
+
+def PackRecord(seq):
+
+    n_starts, n_sizes = Runs(N_RUN, seq)
+    mask_starts, mask_sizes = Runs(MASK_RUN, seq)
+
+    record = [struct.pack('<II', len(seq), len(n_starts)),
+        n_starts.tobytes(), n_sizes.tobytes(),
+        struct.pack('<I', len(mask_starts)),
+        mask_starts.tobytes(), mask_sizes.tobytes(),
+        struct.pack('<I', 0),
+        PackSequence(seq.upper())]
+    if sys.byteorder != 'little':
+        for i in (1, 2, 4, 5):
+            block = array('I', record[i])
+            block.byteswap()
+            record[i] = block.tobytes()
+
+    return b''.join(record)
+
+def ConvertFasta(fasta_handle, store_path):
+    '''
+        Records are packed into a temporary file first,
+        header and index are written once all offsets are known
+    '''
+    names = []
+    sizes = []
+
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(store_path))) as records:
+        for name, seq in seqparse.ReadFasta(fasta_handle):
+            if len(name) > 255:
+                raise ValueError('Entry name longer than 255 bytes: {}'.format(name[:32].decode()))
+            record = PackRecord(seq)
+            records.write(record)
+            names.append(name)
+            sizes.append(len(record))
+
+        header_size = 16 + sum(len(name) + 5 for name in names)
+        version = 0
+        if header_size + sum(sizes) + 4 * len(names) >= 2**32:
+            version = 1
+            header_size += 4 * len(names)
+
+        with open(store_path, 'wb') as store_file:
+            store_file.write(struct.pack('<IIII', SIGNATURE, version, len(names), 0))
+            offset = header_size
+            for name, size in zip(names, sizes):
+                store_file.write(struct.pack('<B', len(name)) + name)
+                store_file.write(struct.pack('<Q' if version else '<I', offset))
+                offset += size
+            records.seek(0)
+            shutil.copyfileobj(records, store_file)
+
+'''
+    Memory-mapped reader
+'''
+
+class TwoBitFile(object):
+
+    def __init__(self, path):
+
+        self.handle = open(path, 'rb')
+        self.data = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.order = '<'
+        signature, version, count, reserved = struct.unpack_from('<IIII', self.data, 0)
+        if signature != SIGNATURE:
+            self.order = '>'
+            signature, version, count, reserved = struct.unpack_from('>IIII', self.data, 0)
+        if signature != SIGNATURE or version not in (0, 1):
+            raise ValueError('{} is not a .2bit file'.format(path))
+
+        offset_format = self.order + ('Q' if version else 'I')
+        offset_size = struct.calcsize(offset_format)
+
+        # entry: [name, record offset]
+        self.entries = []
+        pos = 16
+        for i in range(count):
+            name_size = self.data[pos]
+            name = self.data[pos+1:pos+1+name_size].decode()
+            pos += 1 + name_size
+            self.entries.append([name, struct.unpack_from(offset_format, self.data, pos)[0]])
+            pos += offset_size
+
+        # last index of every name and of every name prefix
+        # before first space, the last one of same-named wins
+        self.names = {}
+        self.short_names = {}
+        for i, (name, offset) in enumerate(self.entries):
+            self.names[name] = i
+            self.short_names[name.split(' ')[0]] = i
+
+        self.records = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        self.data.close()
+        self.handle.close()
+
+    def Name(self, i):
+        return self.entries[i][0]
+
+    def Length(self, i):
+        return struct.unpack_from(self.order + 'I', self.data, self.entries[i][1])[0]
+
+    def Record(self, i):
+        '''
+            Parsed record header: length, N-runs, mask runs, dna offset
+        '''
+        if i in self.records:
+            return self.records[i]
+
+        pos = self.entries[i][1]
+        length, n_count = struct.unpack_from(self.order + 'II', self.data, pos)
+        pos += 8
+        n_starts = self.Block(pos, n_count)
+        n_sizes  = self.Block(pos + 4 * n_count, n_count)
+        pos += 8 * n_count
+        mask_count = struct.unpack_from(self.order + 'I', self.data, pos)[0]
+        pos += 4
+        mask_starts = self.Block(pos, mask_count)
+        mask_sizes  = self.Block(pos + 4 * mask_count, mask_count)
+        pos += 8 * mask_count + 4
+
+        self.records[i] = (length, n_starts, n_sizes, mask_starts, mask_sizes, pos)
+        return self.records[i]
+
+    def Block(self, pos, count):
+
+        block = array('I', self.data[pos:pos + 4 * count])
+        if (self.order == '<') != (sys.byteorder == 'little'):
+            block.byteswap()
+
+        return block
+
+    def Find(self, entry_name, split_space=False):
+        '''
+            Index of entry with given name (or name prefix
+            before first space), the last one of same-named wins
+        '''
+        if split_space:
+            return self.short_names.get(entry_name)
+
+        return self.names.get(entry_name)
+
+    def Fetch(self, i, start=0, end=None):
+        '''
+            Sequence of i-th entry in [start, end) range
+        '''
+        length, n_starts, n_sizes, mask_starts, mask_sizes, dna_offset = self.Record(i)
+        if end is None or end > length:
+            end = length
+        start = max(0, start)
+        if end <= start:
+            return ''
+
+        packed = self.data[dna_offset + start // 4:dna_offset + (end + 3) // 4]
+        shift = start % 4
+        seq = bytearray(b''.join(map(UNPACK_TABLE.__getitem__, packed))[shift:shift + end - start])
+
+        for run_start, run_end in Overlaps(n_starts, n_sizes, start, end):
+            seq[run_start - start:run_end - start] = b'N' * (run_end - run_start)
+        for run_start, run_end in Overlaps(mask_starts, mask_sizes, start, end):
+            seq[run_start - start:run_end - start] = seq[run_start - start:run_end - start].lower()
+
+        return seq.decode()
+
+def Overlaps(starts, sizes, start, end):
+    '''
+        Parts of sorted non-overlapping runs within [start, end)
+    '''
+    i = bisect_right(starts, start) - 1
+    if i < 0 or starts[i] + sizes[i] <= start:
+        i += 1
+    while i < len(starts) and starts[i] < end:
+        yield max(start, starts[i]), min(end, starts[i] + sizes[i])
+        i += 1
+
+if __name__ == '__main__':
+
+    runArgs = GetOptParser().parse_args(sys.argv[1:])
+
+    inputSource = None
+    if runArgs.i is not None:
+        if os.path.isfile(runArgs.i):
+            inputSource = seqopen.OpenInput(runArgs.i, 'rb')
+        else:
+            sys.stderr.write('No such file {}.\nExiting with an error!'.format(runArgs.i))
+            exit()
+
+    if inputSource is None:
+        inputSource = seqopen.OpenInput(None, 'rb')
+
+    if runArgs.o is None:
+        sys.stderr.write('No output file specified.\nExiting with an error!')
+        exit()
+
+    try:
+        ConvertFasta(inputSource, runArgs.o)
+    except ValueError as err:
+        sys.stderr.write('{}\nExiting with an error!'.format(err))
+        exit()